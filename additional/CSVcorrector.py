@@ -1,14 +1,60 @@
-def process_csv(csv_content: str) -> str:
-    lines = csv_content.splitlines()
-    processed_lines = []
-    for line in lines:
-        if line.startswith('#') or not line.strip():
-            processed_lines.append(line)
-        else:
-            parts = line.split(';')
-            if len(parts) >= 14:
-                new_line = ';'.join(parts[:9] + [parts[9], parts[10], parts[9], '0', parts[11], parts[12], parts[13]])
-                processed_lines.append(new_line)
-            else:
-                processed_lines.append(line)
-    return '\n'.join(processed_lines)
+import codecs
+import io
+
+from additional.csv_rules import get_rule
+
+CHUNK_SIZE = 1 << 20  # bytes read from the input at a time
+WRITE_BATCH = 4096  # corrected lines written to the output at a time
+
+
+def process_csv(csv_content: str, rule_name: str = None) -> str:
+    return '\n'.join(get_rule(rule_name).apply(csv_content.splitlines()))
+
+
+def iter_text(src, chunk_size: int = CHUNK_SIZE):
+    # Decoded UTF-8 chunks of a binary file with \r\n and \r turned into \n
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_lines(src, chunk_size: int = CHUNK_SIZE):
+    # Lines of a binary UTF-8 file without the line end. Only one chunk and
+    # one partial line are held at a time.
+    tail = ''
+    for text in iter_text(src, chunk_size):
+        lines = (tail + text).split('\n')
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def iter_corrected_lines(src, chunk_size: int = CHUNK_SIZE, rule_name: str = None):
+    return get_rule(rule_name).apply(iter_lines(src, chunk_size))
+
+
+def process_csv_stream(src, dst, chunk_size: int = CHUNK_SIZE, rule_name: str = None):
+    # Streaming process_csv: reads the binary file src and writes the same
+    # output as process_csv to the binary file dst, in constant memory
+    separator = ''
+    batch = []
+    for line in iter_corrected_lines(src, chunk_size, rule_name):
+        batch.append(line)
+        if len(batch) >= WRITE_BATCH:
+            dst.write((separator + '\n'.join(batch)).encode('utf-8'))
+            separator = '\n'
+            batch.clear()
+    if batch:
+        dst.write((separator + '\n'.join(batch)).encode('utf-8'))
+    dst.flush()
+
+
+def correct_file(src_path: str, dst_path: str, rule_name: str = None):
+    # File-to-file form of process_csv_stream; picklable, so it can run in a process pool
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        process_csv_stream(src, dst, rule_name=rule_name)
@@ -0,0 +1,104 @@
+from operator import itemgetter
+
+KEEP = "keep"
+DROP = "drop"
+
+
+class CSVRule:
+    """
+    Declarative column transform for CSV exports.
+
+    columns lists the output fields in order: an int copies that input column,
+    a str is written as a constant. Rows with fewer than min_columns fields and
+    blank lines are passed through unchanged; lines starting with comment_prefix
+    are kept or dropped according to comments.
+
+    The rule is compiled once into a single operator.itemgetter: a row is split
+    with maxsplit just past the last column used, padded to a fixed width and
+    extended with the constants, so every output field has a fixed index.
+    """
+
+    def __init__(self, name, title, columns, min_columns=None, delimiter=";", comment_prefix="#",
+                 comments=KEEP):
+        indices = [c for c in columns if not isinstance(c, str)]
+        if not indices:
+            raise ValueError(f"Правило {name}: нет ни одного столбца из входного файла")
+        if min(indices) < 0:
+            raise ValueError(f"Правило {name}: номера столбцов должны быть неотрицательными")
+        if comments not in (KEEP, DROP):
+            raise ValueError(f"Правило {name}: comments должно быть {KEEP!r} или {DROP!r}")
+        self.name = name
+        self.title = title
+        self.columns = tuple(columns)
+        self.min_columns = max(indices) + 1 if min_columns is None else min_columns
+        self.delimiter = delimiter
+        self.comment_prefix = comment_prefix
+        self.comments = comments
+        self.transform = self._compile()
+
+    def _compile(self):
+        delimiter = self.delimiter
+        join = delimiter.join
+        min_columns = self.min_columns
+        # str.startswith(()) is always False, so no prefix means no comment lines
+        comment_prefixes = (self.comment_prefix,) if self.comment_prefix else ()
+        drop_comments = self.comments == DROP
+        # A whitespace-only line can only reach min_columns with a whitespace delimiter
+        check_blank = not delimiter.strip()
+        # Fields 0..width-1 are exact, field `width` holds the unused rest of the row
+        width = max(max(c for c in self.columns if not isinstance(c, str)) + 1, min_columns)
+        padding = [""] * (width + 1)
+        constants = []
+        plan = []
+        for c in self.columns:
+            if isinstance(c, str):
+                plan.append(width + 1 + len(constants))
+                constants.append(c)
+            else:
+                plan.append(c)
+        getter = itemgetter(*plan)
+        if len(plan) == 1:
+            single = getter
+            getter = lambda parts: (single(parts),)
+
+        def transform(line):
+            # Returns the corrected line, or None if the line is dropped
+            if line.startswith(comment_prefixes):
+                return None if drop_comments else line
+            parts = line.split(delimiter, width)
+            if len(parts) <= width:
+                # Rows with all `width` fields and more are the common case and skip this
+                if len(parts) < min_columns:
+                    return line
+                parts += padding[len(parts):]
+            if check_blank and not line.strip():
+                return line
+            parts += constants
+            return join(getter(parts))
+
+        return transform
+
+    def apply(self, lines):
+        # Lazily transforms an iterable of lines without line ends
+        if self.comments == DROP:
+            return (line for line in map(self.transform, lines) if line is not None)
+        return map(self.transform, lines)
+
+
+# Rules offered to the user, by name. The first one is the default.
+RULES = {
+    rule.name: rule for rule in (
+        CSVRule(
+            "diagnostics",
+            "Диагностика локомотива",
+            # parts[:9] + [parts[9], parts[10], parts[9], '0', parts[11], parts[12], parts[13]]
+            columns=(*range(9), 9, 10, 9, "0", 11, 12, 13),
+            min_columns=14,
+        ),
+    )
+}
+DEFAULT_RULE = next(iter(RULES))
+
+
+def get_rule(name=None):
+    return RULES[name or DEFAULT_RULE]
@@ -0,0 +1,103 @@
+import math
+
+import numpy as np
+
+from additional.geo_engine import EARTH_RADIUS_KM, DepotSet, distance
+
+# Grid cell size in degrees; ~111 km along the meridian, so a 71 km query
+# touches only a handful of cells around the locomotive.
+CELL_DEG = 1.0
+
+
+class DepotIndex(DepotSet):
+    # Lat/lon bucket grid over refueling points for "depots within R km" queries.
+
+    def __init__(self, depots, cell_deg=CELL_DEG):
+        super().__init__(depots)
+        self.cell_deg = cell_deg
+        self.lat_deg = np.degrees(self.lat)
+        self.lon_deg = np.degrees(self.lon)
+        self.buckets = {}
+        cells = zip(self._cell(self.lat_deg).tolist(), self._cell(self.lon_deg).tolist())
+        for idx, cell in enumerate(cells):
+            self.buckets.setdefault(cell, []).append(idx)
+        self.buckets = {cell: np.array(ids, dtype=np.intp) for cell, ids in self.buckets.items()}
+
+    def _cell(self, deg):
+        return np.floor(np.asarray(deg) / self.cell_deg).astype(np.int64)
+
+    def _cell_candidates(self, ci, cj, radius_km):
+        # Depots in every cell that may hold a point within radius_km of cell (ci, cj)
+        ang = radius_km / EARTH_RADIUS_KM
+        dlat = math.degrees(ang)
+        lat_lo = ci * self.cell_deg - dlat
+        lat_hi = (ci + 1) * self.cell_deg + dlat
+        max_abs_lat = min(max(abs(lat_lo), abs(lat_hi)), 90.0)
+        cos_max = math.cos(math.radians(max_abs_lat))
+        if cos_max <= math.sin(ang):
+            # Query circle reaches a pole: every longitude is possible
+            lon_lo, lon_hi = -180.0, 180.0
+        else:
+            dlon = math.degrees(math.asin(math.sin(ang) / cos_max))
+            lon_lo = cj * self.cell_deg - dlon
+            lon_hi = (cj + 1) * self.cell_deg + dlon
+
+        found = []
+        for i in range(int(math.floor(lat_lo / self.cell_deg)), int(math.floor(lat_hi / self.cell_deg)) + 1):
+            for j in range(int(math.floor(lon_lo / self.cell_deg)), int(math.floor(lon_hi / self.cell_deg)) + 1):
+                ids = self.buckets.get((i, j))
+                if ids is not None:
+                    found.append(ids)
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate(found)
+
+    def candidate_pairs(self, lat_deg, lon_deg, radius_km):
+        """
+        Returns (point_idx, depot_idx) arrays covering every pair closer than
+        radius_km (a superset: callers still check the exact distance).
+        """
+        lat_deg = np.asarray(lat_deg, dtype=np.float64)
+        lon_deg = np.asarray(lon_deg, dtype=np.float64)
+        empty = np.empty(0, dtype=np.intp)
+        if not len(self) or not lat_deg.size:
+            return empty, empty
+
+        cells = np.stack([self._cell(lat_deg), self._cell(lon_deg)], axis=1)
+        uniq, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(uniq) + 1))
+
+        point_parts, depot_parts = [], []
+        for k, (ci, cj) in enumerate(uniq.tolist()):
+            depots = self._cell_candidates(ci, cj, radius_km)
+            if not depots.size:
+                continue
+            points = order[bounds[k]:bounds[k + 1]]
+            point_parts.append(np.repeat(points, depots.size))
+            depot_parts.append(np.tile(depots, points.size))
+        if not point_parts:
+            return empty, empty
+        return np.concatenate(point_parts), np.concatenate(depot_parts)
+
+    def query(self, lat, lon, radius_km):
+        # Indices (into self.rows) of depots within radius_km of the point
+        _, di = self.candidate_pairs([lat], [lon], radius_km)
+        lat_r, lon_r = math.radians(lat), math.radians(lon)
+        dist = distance(lat_r, lon_r, math.cos(lat_r), self.lat[di], self.lon[di], self.cos_lat[di])
+        return di[dist <= radius_km]
+
+
+_index = None
+_index_key = None
+
+
+def get_depot_index(depots):
+    # The grid is rebuilt only when the refuelingpoint rows actually change
+    global _index, _index_key
+    key = tuple((d['id_point'], d['namepoint'], d['latitude'], d['longitude']) for d in depots)
+    if _index is None or key != _index_key:
+        _index = DepotIndex(depots)
+        _index_key = key
+    return _index
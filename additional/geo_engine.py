@@ -0,0 +1,193 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+# Case 1: locomotive is 9–71 km away and heading towards the depot
+APPROACH_MIN_KM = 9.0
+APPROACH_MAX_KM = 71.0
+MAX_COURSE_DIFF = 20.0
+# Case 2: locomotive is closer than 10 km and azimuth is unknown (-1)
+NEARBY_MAX_KM = 10.0
+UNKNOWN_AZIMUTH = -1
+# Track-based detection: notify when the depot is reached within this time
+ETA_HORIZON_MIN = 60.0
+
+# Locomotives are processed in blocks so the distance matrix stays small
+# (4096 x 500 depots ~ 16 MB per float64 matrix).
+CHUNK_SIZE = 4096
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    dlat_rad = math.radians(lat2 - lat1)
+    dlon_rad = math.radians(lon2 - lon1)
+
+    a = math.sin(dlat_rad / 2)**2 + \
+        math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon_rad / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+
+def bearing(lat1, lon1, lat2, lon2):
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    dlon_rad = math.radians(lon2 - lon1)
+
+    x = math.sin(dlon_rad) * math.cos(lat2_rad)
+    y = math.cos(lat1_rad) * math.sin(lat2_rad) - \
+        math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(dlon_rad)
+    azimuth = math.degrees(math.atan2(x, y))
+    return (azimuth + 360) % 360
+
+
+class DepotSet:
+    # Depot coordinates with trig terms computed once per depot list.
+
+    def __init__(self, depots):
+        self.rows = [d for d in depots if d['latitude'] is not None and d['longitude'] is not None]
+        lat = np.radians(np.array([float(d['latitude']) for d in self.rows], dtype=np.float64))
+        lon = np.radians(np.array([float(d['longitude']) for d in self.rows], dtype=np.float64))
+        self.lat = lat
+        self.lon = lon
+        self.sin_lat = np.sin(lat)
+        self.cos_lat = np.cos(lat)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _loco_arrays(locos):
+    rows = [l for l in locos if l['latitude'] is not None and l['longitude'] is not None]
+    lat = np.radians(np.array([float(l['latitude']) for l in rows], dtype=np.float64))
+    lon = np.radians(np.array([float(l['longitude']) for l in rows], dtype=np.float64))
+    azi = np.array(
+        [np.nan if l['azimuth'] is None else float(l['azimuth']) for l in rows],
+        dtype=np.float64
+    )
+    return rows, lat, lon, azi
+
+
+def distance(lat1, lon1, cos1, lat2, lon2, cos2):
+    # Elementwise haversine distance (km) for radian inputs; arrays are
+    # broadcast against each other.
+    sin_dlat = np.sin((lat2 - lat1) * 0.5)
+    sin_dlon = np.sin((lon2 - lon1) * 0.5)
+    a = sin_dlat * sin_dlat + cos1 * cos2 * (sin_dlon * sin_dlon)
+    np.clip(a, 0.0, 1.0, out=a)
+    return (2.0 * EARTH_RADIUS_KM) * np.arcsin(np.sqrt(a))
+
+
+def initial_bearing(lon1, sin1, cos1, lon2, sin2, cos2):
+    # Elementwise initial bearing (deg, 0..360) from point 1 to point 2.
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * cos2
+    y = cos1 * sin2 - sin1 * cos2 * np.cos(dlon)
+    return np.degrees(np.arctan2(x, y)) % 360.0
+
+
+def course_diff(azimuth, brg):
+    diff = np.abs(azimuth - brg) % 360.0
+    return np.minimum(diff, 360.0 - diff)
+
+
+def _collect(li, di, dist, rows, depot_set, lon, sin_lat, cos_lat, azi, known, unknown, approaching, nearby):
+    # Applies both rules to candidate pairs (li[k], di[k]) with distances dist[k]
+
+    # Case 1: bearing is only evaluated for pairs inside the distance window
+    sel = (dist >= APPROACH_MIN_KM) & (dist <= APPROACH_MAX_KM) & known[li]
+    ai, ad, adist = li[sel], di[sel], dist[sel]
+    brg = initial_bearing(
+        lon[ai], sin_lat[ai], cos_lat[ai],
+        depot_set.lon[ad], depot_set.sin_lat[ad], depot_set.cos_lat[ad]
+    )
+    hit = course_diff(azi[ai], brg) <= MAX_COURSE_DIFF
+    for i, j, d in zip(ai[hit].tolist(), ad[hit].tolist(), adist[hit].tolist()):
+        approaching.append((rows[i], depot_set.rows[j], d))
+
+    # Case 2: <10 km and azimuth unknown
+    sel = (dist < NEARBY_MAX_KM) & unknown[li]
+    for i, j, d in zip(li[sel].tolist(), di[sel].tolist(), dist[sel].tolist()):
+        nearby.append((rows[i], depot_set.rows[j], d))
+
+
+def find_matches(locos, depot_set):
+    """
+    Returns (approaching, nearby): lists of (loco_row, depot_row, distance_km)
+    for every pair that matches the "9–71 km and heading within 20°" rule and
+    the "<10 km with azimuth -1" rule respectively.
+    """
+    approaching, nearby = [], []
+    if not len(depot_set):
+        return approaching, nearby
+    rows, lat, lon, azi = _loco_arrays(locos)
+    if not rows:
+        return approaching, nearby
+
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    known = ~np.isnan(azi) & (azi != UNKNOWN_AZIMUTH)
+    unknown = azi == UNKNOWN_AZIMUTH
+    args = (rows, depot_set, lon, sin_lat, cos_lat, azi, known, unknown, approaching, nearby)
+
+    for li, di, dist in _pairs(lat, lon, cos_lat, depot_set, max(APPROACH_MAX_KM, NEARBY_MAX_KM)):
+        _collect(li, di, dist, *args)
+    return approaching, nearby
+
+
+def find_arrivals(locos, heading, speed_kmh, depot_set, horizon_min=ETA_HORIZON_MIN):
+    """
+    ETA-based approach detection for locomotives with a known track.
+
+    heading (deg) and speed_kmh are arrays aligned with locos (rows must have
+    coordinates). Returns a list of (loco_row, depot_row, distance_km,
+    eta_min) for depots within APPROACH_MAX_KM that lie ahead on the course
+    and will be reached within horizon_min minutes at the current speed.
+    """
+    arrivals = []
+    if not len(depot_set) or not len(locos):
+        return arrivals
+    lat = np.radians(np.array([float(l['latitude']) for l in locos], dtype=np.float64))
+    lon = np.radians(np.array([float(l['longitude']) for l in locos], dtype=np.float64))
+    heading = np.asarray(heading, dtype=np.float64)
+    speed_kmh = np.asarray(speed_kmh, dtype=np.float64)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+
+    for li, di, dist in _pairs(lat, lon, cos_lat, depot_set, APPROACH_MAX_KM):
+        eta = dist / speed_kmh[li] * 60.0
+        sel = eta <= horizon_min
+        li, di, dist, eta = li[sel], di[sel], dist[sel], eta[sel]
+        brg = initial_bearing(
+            lon[li], sin_lat[li], cos_lat[li],
+            depot_set.lon[di], depot_set.sin_lat[di], depot_set.cos_lat[di]
+        )
+        hit = course_diff(heading[li], brg) <= MAX_COURSE_DIFF
+        for i, j, d, e in zip(li[hit].tolist(), di[hit].tolist(), dist[hit].tolist(), eta[hit].tolist()):
+            arrivals.append((locos[i], depot_set.rows[j], d, e))
+    return arrivals
+
+
+def _pairs(lat, lon, cos_lat, depot_set, radius):
+    # Yields (loco_idx, depot_idx, distance_km) blocks for all pairs within radius.
+    # With a DepotIndex only nearby candidate pairs are evaluated,
+    # otherwise the full locomotive x depot matrix is computed.
+    candidate_pairs = getattr(depot_set, 'candidate_pairs', None)
+    if candidate_pairs is not None:
+        li, di = candidate_pairs(np.degrees(lat), np.degrees(lon), radius)
+        dist = distance(
+            lat[li], lon[li], cos_lat[li],
+            depot_set.lat[di], depot_set.lon[di], depot_set.cos_lat[di]
+        )
+        keep = dist <= radius
+        yield li[keep], di[keep], dist[keep]
+        return
+
+    for start in range(0, len(lat), CHUNK_SIZE):
+        block = slice(start, start + CHUNK_SIZE)
+        dist = distance(
+            lat[block, None], lon[block, None], cos_lat[block, None],
+            depot_set.lat[None, :], depot_set.lon[None, :], depot_set.cos_lat[None, :]
+        )
+        li, di = np.nonzero(dist <= radius)
+        yield li + start, di, dist[li, di]
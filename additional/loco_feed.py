@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+import numpy as np
+
+from additional.geo_engine import find_arrivals, find_matches
+from additional.trajectory import TrajectoryStore
+
+POSITION_WINDOW = timedelta(minutes=10)
+# Rows committed late with a slightly older dt are still picked up;
+# per-section watermarks drop the duplicates.
+WATERMARK_OVERLAP = timedelta(minutes=1)
+
+
+def _has_coords(row):
+    return row['latitude'] is not None and row['longitude'] is not None
+
+
+class LocomotiveFeed:
+    """
+    Incremental reader of locomotiveipadresses.
+
+    Keeps a dt watermark per section and the last known position of every
+    section seen within POSITION_WINDOW; geo matching is re-run only for
+    sections whose position changed since the previous cycle.
+
+    Sections with enough history in the trajectory store are matched by
+    predicted arrival time (find_arrivals); the rest fall back to the
+    single-fix azimuth/distance rules (find_matches).
+    """
+
+    def __init__(self, window=POSITION_WINDOW, overlap=WATERMARK_OVERLAP):
+        self.window = window
+        self.overlap = overlap
+        self.positions = {}   # section -> last row
+        self.watermarks = {}  # section -> dt of that row
+        self.max_dt = None
+        self.changed = set()
+        self._matches = {}    # section -> (approaching, nearby)
+        self._index = None
+        self.tracks = TrajectoryStore()
+
+    def poll(self, cur):
+        # Reads rows newer than the watermark with the given cursor
+        # (DictCursor) and returns the sections whose position moved.
+        cur.execute("SELECT NOW()")
+        db_now = cur.fetchone()[0]
+        if self.max_dt is None:
+            cur.execute(
+                "SELECT section, latitude, longitude, azimuth, dt "
+                "FROM locomotiveipadresses "
+                "WHERE dt >= NOW() - INTERVAL '10 minutes' "
+                "ORDER BY dt"
+            )
+        else:
+            cur.execute(
+                "SELECT section, latitude, longitude, azimuth, dt "
+                "FROM locomotiveipadresses "
+                "WHERE dt > %s AND dt >= NOW() - INTERVAL '10 minutes' "
+                "ORDER BY dt",
+                (self.max_dt - self.overlap,)
+            )
+        self.apply(cur.fetchall())
+        self.expire(db_now - self.window)
+        return self.changed
+
+    def apply(self, rows):
+        for row in rows:
+            section, dt = row['section'], row['dt']
+            last_dt = self.watermarks.get(section)
+            if last_dt is not None and dt <= last_dt:
+                continue
+            self.watermarks[section] = dt
+            if self.max_dt is None or dt > self.max_dt:
+                self.max_dt = dt
+            old = self.positions.get(section)
+            self.positions[section] = row
+            if _has_coords(row):
+                self.tracks.push(section, float(row['latitude']), float(row['longitude']), dt.timestamp())
+            if old is None or (old['latitude'], old['longitude'], old['azimuth']) != \
+                    (row['latitude'], row['longitude'], row['azimuth']):
+                self.changed.add(section)
+
+    def expire(self, cutoff):
+        # cutoff comes from NOW() and is timezone-aware; a timestamp column without
+        # time zone is compared with the same wall time, as Postgres itself does
+        naive_cutoff = cutoff.replace(tzinfo=None)
+        expired = [s for s, dt in self.watermarks.items() if dt < (naive_cutoff if dt.tzinfo is None else cutoff)]
+        for section in expired:
+            del self.watermarks[section]
+            del self.positions[section]
+            self._matches.pop(section, None)
+            self.tracks.remove(section)
+            self.changed.discard(section)
+
+    def match(self, depot_index):
+        # (approaching, nearby) for every live section; unchanged sections
+        # are served from the previous cycle's results.
+        if depot_index is not self._index:
+            self._index = depot_index
+            self._matches.clear()
+            self.changed = set(self.positions)
+
+        fresh = {section: ([], []) for section in self.changed}
+        changed = list(self.changed)
+        heading, speed, valid = self.tracks.motion(changed)
+        # The newest fix may have no coordinates while the track still has older ones;
+        # find_arrivals needs the position itself, so such sections are untracked.
+        valid = valid & np.array([_has_coords(self.positions[s]) for s in changed], dtype=bool)
+        tracked = [self.positions[s] for s, ok in zip(changed, valid) if ok]
+        untracked = [self.positions[s] for s, ok in zip(changed, valid) if not ok]
+
+        arrivals = find_arrivals(tracked, heading[valid], speed[valid], depot_index)
+        for loco, depot, dist, _eta in arrivals:
+            fresh[loco['section']][0].append((loco, depot, dist))
+        approaching, nearby = find_matches(untracked, depot_index)
+        for loco, depot, dist in approaching:
+            fresh[loco['section']][0].append((loco, depot, dist))
+        for loco, depot, dist in nearby:
+            fresh[loco['section']][1].append((loco, depot, dist))
+        self._matches.update(fresh)
+        self.changed = set()
+
+        approaching, nearby = [], []
+        for a, n in self._matches.values():
+            approaching.extend(a)
+            nearby.extend(n)
+        return approaching, nearby
@@ -1,73 +1,66 @@
 import asyncio
-import math
 import psycopg2
 import psycopg2.extras
-from main.bot import bot
-from database.database import get_connection, get_connection2
-from database import sqlite_db, settings_db
-from database.settings_db import get_domain
+from main.bot import bot, send_scheduler
+from main.send_scheduler import BULK
+from main.notify_coalescer import NotificationCoalescer
+from database.async_db import run_db
+from database.database import get_connection2
+from database import settings_db
+from database import notify_state_db
+from database.recipients_db import recipients
+from database.settings_db import get_domain_async
+from additional.depot_index import get_depot_index
+from additional.loco_feed import LocomotiveFeed
+from additional.tickets import fetch_tickets, section_key
 settings_db.init_settings_db()
+notify_state_db.init_notify_state_db()
 
-EARTH_RADIUS_KM = 6371.0
+# Namespace of this tracker's keys in notification_log
+NOTIFY_NAMESPACE = "prod"
 
-def haversine(lat1, lon1, lat2, lon2):
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    dlat_rad = math.radians(lat2 - lat1)
-    dlon_rad = math.radians(lon2 - lon1)
+feed = LocomotiveFeed()
+# Messages for one employee within a cycle are merged into as few as possible
+coalescer = NotificationCoalescer(send_scheduler, bot)
 
-    a = math.sin(dlat_rad / 2)**2 + \
-        math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon_rad / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return EARTH_RADIUS_KM * c
-
-def bearing(lat1, lon1, lat2, lon2):
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    dlon_rad = math.radians(lon2 - lon1)
-
-    x = math.sin(dlon_rad) * math.cos(lat2_rad)
-    y = math.cos(lat1_rad) * math.sin(lat2_rad) - \
-        math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(dlon_rad)
-    azimuth = math.degrees(math.atan2(x, y))
-    return (azimuth + 360) % 360
-
-async def process_tracking():
-    # Load refueling points (depots)
+def load_depots_and_positions():
     with get_connection2() as conn2:
         cur = conn2.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        # Load refueling points (depots)
         cur.execute("SELECT id_point, namepoint, latitude, longitude FROM refuelingpoint")
         depots = cur.fetchall()
+        # Only rows newer than the per-section watermark are read
+        feed.poll(cur)
+    return depots
 
-    with get_connection2() as conn2:
-        cur = conn2.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT section, latitude, longitude, azimuth FROM locomotiveipadresses WHERE dt >= NOW() - INTERVAL '10 minutes'")
-        locos = cur.fetchall()
-
-    for loco in locos:
-        section = loco['section']
-        lat_l, lon_l, azi_l = loco['latitude'], loco['longitude'], loco['azimuth']
-
-        for depot in depots:
-            lat_d, lon_d = depot['latitude'], depot['longitude']
-            dist = haversine(lat_l, lon_l, lat_d, lon_d)
+async def process_tracking():
+    depots = await run_db(load_depots_and_positions)
+    approaching, nearby = feed.match(get_depot_index(depots))
 
-            if 9 <= dist <= 71 and azi_l != -1:
-                bearing_to_depot = bearing(lat_l, lon_l, lat_d, lon_d)
-                course_diff = min((azi_l - bearing_to_depot) % 360,
-                                  (bearing_to_depot - azi_l) % 360)
-                if course_diff <= 20:
-                    await send_ticket_messages(section, depot, dist)
+    # One helpdesk query for every section that matched at least one depot
+    sections = {loco['section'] for loco, _, _ in approaching + nearby}
+    tickets_by_section = await run_db(fetch_tickets, sections)
 
-            # Case 2: <10 km and azimuth unknown
-            elif dist < 10 and azi_l == -1:
-                await send_location_and_tickets(section, depot, dist, lat_l, lon_l)
+    # All sections are sent concurrently so the coalescer can merge them per chat
+    sends = [
+        send_ticket_messages(loco['section'], depot, dist, tickets_by_section.get(section_key(loco['section'])))
+        for loco, depot, dist in approaching
+    ]
+    # Case 2: <10 km and azimuth unknown
+    sends += [
+        send_location_and_tickets(loco['section'], depot, dist, loco['latitude'], loco['longitude'],
+                                  tickets_by_section.get(section_key(loco['section'])))
+        for loco, depot, dist in nearby
+    ]
+    await asyncio.gather(*sends)
 
-async def send_ticket_messages(section, depot, distance):
-    tickets = fetch_tickets(section)
+async def send_ticket_messages(section, depot, distance, tickets):
     if not tickets:
         return
-    employees = fetch_employees(depot['id_point'])
+    base = await get_domain_async()
+    key = notify_state_db.notification_key(NOTIFY_NAMESPACE, section, depot['id_point'])
+    if not await run_db(notify_state_db.claim, key):
+        return
     # Build header
     lines = [
         f"🚆 Локомотив «{section}» → депо «{depot['namepoint']}»",
@@ -77,15 +70,17 @@ async def send_ticket_messages(section, depot, distance):
     ]
     # Append tickets
     for t in tickets:
-        lines += format_ticket(t)
+        lines += format_ticket(t, base)
     message = "\n".join(lines)
-    await send_bot_messages(employees, message)
+    await deliver_claimed(key, depot['id_point'], message)
 
-async def send_location_and_tickets(section, depot, distance, lat, lon):
-    tickets = fetch_tickets(section)
+async def send_location_and_tickets(section, depot, distance, lat, lon, tickets):
     if not tickets:
         return
-    employees = fetch_employees(depot['id_point'])
+    base = await get_domain_async()
+    key = notify_state_db.notification_key(NOTIFY_NAMESPACE, section, depot['id_point'])
+    if not await run_db(notify_state_db.claim, key):
+        return
     # Build message
     lines = [
         f"🚆 Локомотив «{section}» → депо «{depot['namepoint']}»",
@@ -96,40 +91,14 @@ async def send_location_and_tickets(section, depot, distance, lat, lon):
         "📋 *Активные заявки за 14 дней:*"
     ]
     for t in tickets:
-        lines += format_ticket(t)
+        lines += format_ticket(t, base)
     message = "\n".join(lines)
-    await send_bot_messages(employees, message)
-
-async def fetch_tickets(section):
-    with get_connection() as conn1:
-        cur = conn1.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(
-            """
-            SELECT id, created, description
-            FROM helpdesk_ticket
-            WHERE section_id = %s
-              AND created >= NOW() - INTERVAL '14 days'
-              AND status != 3
-            ORDER BY created DESC
-            """, (section,)
-        )
-        return cur.fetchall()
-
-async def fetch_employees(depot_id):
-    with get_connection() as conn1:
-        cur = conn1.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(
-            "SELECT user_id, phone FROM helpdesk_employee WHERE depot_id = %s",
-            (depot_id,)
-        )
-        return cur.fetchall()
-
+    await deliver_claimed(key, depot['id_point'], message)
 
-def format_ticket(t):
+def format_ticket(t, base):
     ticket_id = t['id']
     created_str = t['created'].strftime("%Y-%m-%d %H:%M")
     desc = t['description'] or ""
-    base = get_domain()
     url = f"{base}{ticket_id}/"
     return [
         f"- *#{ticket_id}* [{created_str}] {desc}",
@@ -137,24 +106,33 @@ def format_ticket(t):
         ""
     ]
 
-async def send_bot_messages(employees, message):
-    for emp in employees:
-        phone = emp['phone']
-        if not phone:
-            continue
-        if not phone.startswith('+'):
-            phone = '+' + phone
-        async with sqlite_db._db_lock:
-            db = await sqlite_db.get_db_connection()
-            cur = await db.execute("SELECT telegram_id FROM users WHERE phone = ?", (phone,))
-            row = await cur.fetchone()
-        if not row:
-            continue
-        tg_id = row[0]
-        try:
-            await bot.send_message(chat_id=tg_id, text=message, parse_mode='Markdown')
-        except Exception as e:
-            print(f"Ошибка отправки {tg_id}: {e}")
+async def deliver_claimed(key, depot_id, message):
+    # The key was claimed before sending; if nobody received the message the claim
+    # is released so the next cycle tries again instead of staying silent for 3 hours
+    try:
+        chat_ids = await recipients.get(depot_id)
+        delivered = await send_bot_messages(chat_ids, message) if chat_ids else 0
+    except BaseException:
+        await run_db(notify_state_db.release, key)
+        raise
+    if not delivered:
+        await run_db(notify_state_db.release, key)
+
+async def send_bot_messages(chat_ids, message):
+    # Concurrent fan-out in the bulk lane, merged per chat and paced by the send scheduler.
+    # Returns how many chats got the message.
+    chat_ids = list(chat_ids)
+    results = await asyncio.gather(
+        *(coalescer.send(tg_id, message, priority=BULK, parse_mode='Markdown') for tg_id in chat_ids),
+        return_exceptions=True
+    )
+    delivered = 0
+    for tg_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            print(f"Ошибка отправки {tg_id}: {result}")
+        else:
+            delivered += 1
+    return delivered
 
 async def main():
     while True:
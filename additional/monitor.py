@@ -2,118 +2,111 @@ import asyncio
 import psycopg2
 import psycopg2.extras
 
-from main.bot import bot
+from main.bot import bot, send_scheduler
+from main.send_scheduler import NORMAL
+from main.notify_coalescer import NotificationCoalescer
+from database.async_db import run_db
 from database.database import get_connection, get_connection2
-from database import sqlite_db, settings_db
-from database.settings_db import get_domain
+from database import notify_state_db, sqlite_db, settings_db
+from database.settings_db import get_domain_async
 settings_db.init_settings_db()
+notify_state_db.init_notify_state_db()
 
-def get_employee_data_by_executor(executor_id: int):
-    try:
-        with get_connection() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                cursor.execute(
-                    "SELECT user_id, phone FROM helpdesk_employee WHERE user_id = %s",
-                    (executor_id,)
-                )
-                result = cursor.fetchone()
-                if result:
-                    return result["user_id"], result["phone"]
-                return None, None
-    except Exception as e:
-        print(f"Error fetching employee data for executor_id {executor_id}: {e}")
-        return None, None
+# Several tickets of one executor in a cycle arrive as one message
+coalescer = NotificationCoalescer(send_scheduler, bot)
+
+def fetch_offline_tickets():
+    # Tickets together with the section code and the executor's phone
+    with get_connection() as conn17:
+        with conn17.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor17:
+            cursor17.execute("""
+                SELECT t.id, t.created, t.executor_id, t.section_id, s.code, e.phone
+                FROM helpdesk_ticket t
+                JOIN helpdesk_locomotivesection s ON s.id = t.section_id
+                LEFT JOIN LATERAL (
+                    SELECT phone FROM helpdesk_employee
+                    WHERE user_id = t.executor_id
+                    LIMIT 1
+                ) e ON TRUE
+                WHERE t.description LIKE '%Локомотив не на связи%'
+                  AND t.created >= NOW() - INTERVAL '24 hours'
+                  AND t.status != 3
+            """)
+            return cursor17.fetchall()
+
+def fetch_online_sections(codes):
+    # code -> latest position row from the last 5 minutes
+    if not codes:
+        return {}
+    with get_connection2() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(
+                """
+                SELECT DISTINCT ON (section) section, dt, placement
+                FROM locomotiveipadresses
+                WHERE section = ANY(%s)
+                  AND dt >= NOW() - INTERVAL '5 minutes'
+                ORDER BY section, dt DESC;
+                """,
+                (list(codes),)
+            )
+            return {row["section"]: row for row in cursor.fetchall()}
 
 async def process_monitoring():
     try:
-        with get_connection() as conn17:
-            with conn17.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor17:
-                cursor17.execute("""
-                    SELECT id, created, executor_id, description, section_id
-                    FROM helpdesk_ticket
-                    WHERE description LIKE '%Локомотив не на связи%'
-                      AND created >= NOW() - INTERVAL '24 hours'
-                      AND status != 3
-                """)
-                tickets = cursor17.fetchall()
+        tickets = await run_db(fetch_offline_tickets)
     except Exception as e:
         print(f"Error fetching tickets: {e}")
         return
 
+    # Only tickets whose recovery has not been announced yet
+    fresh = await run_db(notify_state_db.filter_unannounced, [(ticket["id"], ticket["code"]) for ticket in tickets])
+    tickets = [ticket for ticket in tickets if (ticket["id"], ticket["code"]) in fresh]
+    if not tickets:
+        return
+
+    try:
+        online = await run_db(fetch_online_sections, {ticket["code"] for ticket in tickets})
+    except Exception as e:
+        print(f"Error fetching locomotives: {e}")
+        return
+
     notifications = []
     for ticket in tickets:
-        executor_id = ticket["executor_id"]
-        section_id = ticket["section_id"]
-
-        try:
-            with get_connection() as conn17:
-                with conn17.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor17:
-                    cursor17.execute(
-                        "SELECT code FROM helpdesk_locomotivesection WHERE id = %s",
-                        (section_id,)
-                    )
-                    section_row = cursor17.fetchone()
-                    if not section_row:
-                        continue
-                    code = section_row["code"]
-        except Exception as e:
-            print(f"Error fetching section for section_id {section_id}: {e}")
+        loco_row = online.get(ticket["code"])
+        if not loco_row:
             continue
-
-        try:
-            with get_connection2() as conn:
-                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                    cursor.execute(
-                        """
-                        SELECT section, dt, placement FROM locomotiveipadresses
-                        WHERE section = %s
-                          AND dt >= NOW() - INTERVAL '5 minutes';
-                        """,
-                        (code,)
-                    )
-                    loco_row = cursor.fetchone()
-                    if not loco_row:
-                        continue
-                    loco_section = loco_row["section"]
-                    loco_dt = loco_row["dt"]
-                    placement = loco_row["placement"]
-        except Exception as e:
-            print(f"Error fetching locomotive for code {code}: {e}")
+        phone = ticket["phone"]
+        if not phone:
+            print(f"No phone found for executor_id {ticket['executor_id']}")
             continue
-
+        if not phone.startswith("+"):
+            phone = "+" + phone
         notifications.append({
-            "executor_id": executor_id,
+            "phone": phone,
             "ticket_id": ticket["id"],
             "ticket_created": ticket["created"],
-            "loco_section": loco_section,
-            "loco_dt": loco_dt,
-            "placement": placement
+            "loco_section": loco_row["section"],
+            "loco_dt": loco_row["dt"],
+            "placement": loco_row["placement"]
         })
+    if not notifications:
+        return
 
-    for notif in notifications:
-        emp_user_id, phone = get_employee_data_by_executor(notif["executor_id"])
-        if not phone:
-            print(f"No phone found for executor_id {notif['executor_id']}")
-            continue
-        if not phone.startswith("+"):
-            phone = "+" + phone
+    users = await sqlite_db.get_users_by_phones(n["phone"] for n in notifications)
+    base = await get_domain_async()
 
-        async with sqlite_db._db_lock:
-            db = await sqlite_db.get_db_connection()
-            cursor = await db.execute(
-                "SELECT telegram_id, notifications_enabled FROM users WHERE phone = ?",
-                (phone,)
-            )
-            user_row = await cursor.fetchone()
+    async def notify(notif):
+        phone = notif["phone"]
+        user_row = users.get(phone)
         if not user_row:
             print(f"No telegram user found for phone {phone}")
-            continue
+            return None
         telegram_id, notifications_enabled = user_row
         if not notifications_enabled:
             print(f"Notifications disabled for telegram_id {telegram_id}")
-            continue
+            return None
 
-        base = get_domain()
         url = f"{base}{notif['ticket_id']}/"
         message_text = (
             f"Локомотив \"{notif['loco_section']}\" вышел на связь с \"{notif['loco_dt']}\". "
@@ -121,10 +114,19 @@ async def process_monitoring():
             f"по описанию \"локомотив не на связи\"\nСсылка: {url}"
         )
         try:
-            await bot.send_message(chat_id=telegram_id, text=message_text)
+            await coalescer.send(telegram_id, message_text, priority=NORMAL)
             print(f"Sent notification to telegram_id {telegram_id}: {message_text}")
+            return notif["ticket_id"], notif["loco_section"]
         except Exception as e:
             print(f"Error sending telegram message to {telegram_id}: {e}")
+            return None
+
+    # Sent concurrently so the coalescer can merge messages for the same executor
+    results = await asyncio.gather(*(notify(notif) for notif in notifications))
+    announced = [key for key in results if key is not None]
+
+    if announced:
+        await run_db(notify_state_db.mark_announced, announced)
 
 async def main():
     while True:
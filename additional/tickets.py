@@ -0,0 +1,37 @@
+import psycopg2.extras
+
+from database.database import get_connection
+
+
+def section_key(section):
+    # Canonical form of a section code: the decimal number without zero padding,
+    # or None for codes that cannot match the integer helpdesk_ticket.section_id
+    code = str(section).strip()
+    return str(int(code)) if code.isdecimal() else None
+
+
+def _section_ids(sections):
+    return sorted({int(key) for key in map(section_key, sections) if key is not None})
+
+
+def fetch_tickets(sections):
+    # Active 14-day tickets for all sections at once, grouped by section_key
+    tickets_by_section = {}
+    section_ids = _section_ids(sections)
+    if not section_ids:
+        return tickets_by_section
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            cur.execute(
+                """
+                SELECT id, created, description, section_id
+                FROM helpdesk_ticket
+                WHERE section_id = ANY(%s::int[])
+                  AND created >= NOW() - INTERVAL '14 days'
+                  AND status != 3
+                ORDER BY created DESC
+                """, (section_ids,)
+            )
+            for t in cur.fetchall():
+                tickets_by_section.setdefault(section_key(t['section_id']), []).append(t)
+    return tickets_by_section
@@ -0,0 +1,104 @@
+import numpy as np
+
+from additional.geo_engine import distance, initial_bearing
+
+HISTORY_SIZE = 8        # fixes kept per section
+INITIAL_CAPACITY = 1024  # sections; grows by doubling
+# Below these the track is treated as "standing" and heading is unreliable
+MIN_TRACK_KM = 0.3
+MIN_SPEED_KMH = 5.0
+
+
+class TrajectoryStore:
+    """
+    Ring buffer of the last HISTORY_SIZE fixes per section, stored in
+    preallocated (sections x HISTORY_SIZE) arrays: ~200 bytes per section,
+    about 2 MB for 10k sections.
+    """
+
+    def __init__(self, size=HISTORY_SIZE, capacity=INITIAL_CAPACITY):
+        self.size = size
+        self.slots = {}  # section -> row in the arrays
+        self._free = []
+        self.lat = np.zeros((capacity, size), dtype=np.float64)  # radians
+        self.lon = np.zeros((capacity, size), dtype=np.float64)  # radians
+        self.ts = np.zeros((capacity, size), dtype=np.float64)   # epoch seconds
+        self.head = np.zeros(capacity, dtype=np.int32)   # next write position
+        self.count = np.zeros(capacity, dtype=np.int32)  # valid fixes
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self):
+        capacity = len(self.head)
+        for name in ('lat', 'lon', 'ts'):
+            arr = getattr(self, name)
+            setattr(self, name, np.concatenate([arr, np.zeros_like(arr)]))
+        self.head = np.concatenate([self.head, np.zeros(capacity, dtype=np.int32)])
+        self.count = np.concatenate([self.count, np.zeros(capacity, dtype=np.int32)])
+
+    def _slot(self, section):
+        slot = self.slots.get(section)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self.slots)
+                if slot >= len(self.head):
+                    self._grow()
+            self.head[slot] = 0
+            self.count[slot] = 0
+            self.slots[section] = slot
+        return slot
+
+    def push(self, section, lat_deg, lon_deg, ts):
+        slot = self._slot(section)
+        pos = self.head[slot]
+        self.lat[slot, pos] = np.radians(lat_deg)
+        self.lon[slot, pos] = np.radians(lon_deg)
+        self.ts[slot, pos] = ts
+        self.head[slot] = (pos + 1) % self.size
+        if self.count[slot] < self.size:
+            self.count[slot] += 1
+
+    def remove(self, section):
+        slot = self.slots.pop(section, None)
+        if slot is not None:
+            self.count[slot] = 0
+            self._free.append(slot)
+
+    def motion(self, sections):
+        """
+        Heading (deg) and speed (km/h) for each section, derived from the
+        oldest and newest fix in its buffer. Returns (heading, speed, valid);
+        valid is False for sections with fewer than two fixes or that have
+        not moved at least MIN_TRACK_KM at MIN_SPEED_KMH.
+        """
+        slots = np.array([self.slots.get(s, -1) for s in sections], dtype=np.intp)
+        n = len(slots)
+        heading = np.full(n, np.nan)
+        speed = np.zeros(n)
+        valid = np.zeros(n, dtype=bool)
+
+        known = slots >= 0
+        rows = slots[known]
+        if not rows.size:
+            return heading, speed, valid
+        count = self.count[rows]
+        newest = (self.head[rows] - 1) % self.size
+        oldest = (self.head[rows] - count) % self.size
+
+        lat1, lon1 = self.lat[rows, oldest], self.lon[rows, oldest]
+        lat2, lon2 = self.lat[rows, newest], self.lon[rows, newest]
+        cos1, cos2 = np.cos(lat1), np.cos(lat2)
+        track_km = distance(lat1, lon1, cos1, lat2, lon2, cos2)
+        hours = (self.ts[rows, newest] - self.ts[rows, oldest]) / 3600.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spd = np.where(hours > 0, track_km / hours, 0.0)
+        brg = initial_bearing(lon1, np.sin(lat1), cos1, lon2, np.sin(lat2), cos2)
+
+        ok = (count >= 2) & (track_km >= MIN_TRACK_KM) & (spd >= MIN_SPEED_KMH)
+        heading[known] = np.where(ok, brg, np.nan)
+        speed[known] = np.where(ok, spd, 0.0)
+        valid[known] = ok
+        return heading, speed, valid
@@ -4,15 +4,17 @@ import sqlite3
 from aiogram import Bot, Dispatcher, types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
 from aiogram.filters import Command
+from database.async_db import run_db
 from database.database import check_phone_in_postgres
-from database.sqlite_db import check_user_by_telegram_id
+from database.fsm_storage import SQLiteStorage
+from database.sqlite_db import check_user_by_telegram_id, engine as sqlite_engine
 
 API_TOKEN = os.getenv("ADMIN_TG_API_KEY")
 bot = Bot(token=API_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+storage = SQLiteStorage(sqlite_engine)
+dp = Dispatcher(storage=storage)
 
 class AdminStates(StatesGroup):
     waiting_for_contact = State()
@@ -52,7 +54,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
 @dp.message(lambda msg: msg.contact is not None, AdminStates.waiting_for_contact)
 async def process_contact(message: types.Message, state: FSMContext):
     phone = f"+{message.contact.phone_number.lstrip('+')}"
-    user_data = check_phone_in_postgres(phone)
+    user_data = await run_db(check_phone_in_postgres, phone)
     if user_data:
         await message.answer("Доступ предоставлен.", reply_markup=admin_keyboard())
         await state.clear()
@@ -104,9 +106,17 @@ async def process_new_domain(message: types.Message, state: FSMContext):
     await state.clear()
 
 
+async def main():
+    try:
+        await dp.start_polling(bot, skip_updates=True)
+    finally:
+        await storage.close()
+        await sqlite_engine.close()
+
+
 if __name__ == "__main__":
     import asyncio
 
     from database import settings_db
     settings_db.init_settings_db()
-    asyncio.run(dp.start_polling(bot, skip_updates=True))
+    asyncio.run(main())
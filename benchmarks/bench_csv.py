@@ -0,0 +1,97 @@
+# Throughput and peak RSS of CSVcorrector.process_csv versus process_csv_stream.
+#
+#   python -m benchmarks.bench_csv --sizes 100,1000
+#
+# Sizes are in MB; the input files are generated in a temporary directory.
+# "old" reads the file into a string, corrects it with process_csv and writes
+# the result, as the bot did before. "new" streams file to file. Each run is a
+# separate process so its peak RSS is measured on its own.
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from additional import CSVcorrector
+
+
+def make_line(rnd):
+    if rnd.random() < 0.02:
+        return "# комментарий выгрузки диагностики"
+    values = [f"{rnd.uniform(0, 1000):.3f}" for _ in range(15)]
+    values[0] = f"2024-05-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:00"
+    values[1] = f"2ТЭ10М-{rnd.randint(1, 9999)}"
+    return ";".join(values)
+
+
+def make_input(path, size_mb):
+    rnd = random.Random(7)
+    lines = [make_line(rnd) for _ in range(10000)]
+    block = ("\r\n".join(lines) + "\r\n").encode("utf-8")
+    with open(path, "wb") as f:
+        for _ in range(size_mb * (1 << 20) // len(block) + 1):
+            f.write(block)
+
+
+def run_old(src_path, dst_path):
+    with open(src_path, "rb") as f:
+        content = f.read().decode("utf-8")
+    with open(dst_path, "wb") as f:
+        f.write(CSVcorrector.process_csv(content).encode("utf-8"))
+
+
+def run_new(src_path, dst_path):
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        CSVcorrector.process_csv_stream(src, dst)
+
+
+def worker(mode, src_path, dst_path):
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    (run_old if mode == "old" else run_new)(src_path, dst_path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux
+    print(elapsed, base_rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def measure(mode, src_path, dst_path):
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_csv", "--worker", mode, src_path, dst_path],
+        check=True, capture_output=True, text=True
+    ).stdout.split()
+    elapsed, base_rss, peak_rss = float(out[0]), int(out[1]), int(out[2])
+    return elapsed, base_rss / 1024, peak_rss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,1000", help="input sizes in MB")
+    parser.add_argument("--worker", nargs=3, metavar=("MODE", "SRC", "DST"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    print(f"{'size, MB':>9} {'mode':>5} {'time, s':>8} {'MB/s':>7} {'peak RSS, MB':>13} {'over base, MB':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        src_path = os.path.join(tmp, "input.csv")
+        for size_mb in (int(s) for s in args.sizes.split(",")):
+            make_input(src_path, size_mb)
+            actual_mb = os.path.getsize(src_path) / (1 << 20)
+            outputs = {}
+            for mode in ("old", "new"):
+                outputs[mode] = os.path.join(tmp, f"{mode}.csv")
+                elapsed, base_rss, peak_rss = measure(mode, src_path, outputs[mode])
+                print(f"{size_mb:>9} {mode:>5} {elapsed:>8.2f} {actual_mb / elapsed:>7.1f} "
+                      f"{peak_rss:>13.0f} {peak_rss - base_rss:>14.0f}")
+            if os.path.getsize(outputs["old"]) != os.path.getsize(outputs["new"]):
+                print(f"{size_mb:>9} outputs differ!")
+            for path in outputs.values():
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Per-line cost of the compiled CSV rule versus the hard-coded remapping it replaced.
+# Run from the repository root: python -m benchmarks.bench_csv_rules --lines 1000000
+#
+# "hard-coded" is the previous CSVcorrector line function; "rule" is the default
+# rule from additional.csv_rules. Both map the same in-memory lines, so only the
+# transform itself is measured; outputs are compared before timing.
+import argparse
+import random
+import time
+
+from additional.csv_rules import get_rule
+from benchmarks.bench_csv import make_line
+
+REPEATS = 5
+
+
+def hard_coded(line):
+    if line.startswith('#') or not line.strip():
+        return line
+    parts = line.split(';')
+    if len(parts) >= 14:
+        return ';'.join(parts[:9] + [parts[9], parts[10], parts[9], '0', parts[11], parts[12], parts[13]])
+    return line
+
+
+def timed(fn, lines):
+    start = time.perf_counter()
+    for _ in fn(lines):
+        pass
+    return time.perf_counter() - start
+
+
+def best_of(variants, lines):
+    # Variants alternate within each repeat so both see the same machine load
+    best = [float("inf")] * len(variants)
+    for _ in range(REPEATS):
+        for i, fn in enumerate(variants):
+            best[i] = min(best[i], timed(fn, lines))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    rnd = random.Random(7)
+    lines = [make_line(rnd) for _ in range(args.lines)]
+    rule = get_rule()
+    assert list(map(hard_coded, lines)) == list(rule.apply(lines))
+
+    old, new = best_of((lambda ls: map(hard_coded, ls), rule.apply), lines)
+    print(f"{'variant':>11} {'ns/line':>8} {'Mlines/s':>9}")
+    for name, elapsed in (("hard-coded", old), ("rule", new)):
+        print(f"{name:>11} {elapsed / args.lines * 1e9:>8.0f} {args.lines / elapsed / 1e6:>9.2f}")
+    print(f"speedup: {old / new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
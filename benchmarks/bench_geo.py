@@ -0,0 +1,82 @@
+# Scalar haversine()/bearing() double loop vs. the batched NumPy engine
+# (full matrix and grid-pruned via DepotIndex).
+# Run from the repository root: python -m benchmarks.bench_geo
+import random
+import time
+
+from additional.depot_index import DepotIndex
+from additional.geo_engine import (
+    APPROACH_MAX_KM, APPROACH_MIN_KM, MAX_COURSE_DIFF, NEARBY_MAX_KM,
+    DepotSet, bearing, find_matches, haversine,
+)
+
+DEPOTS = 500
+FLEETS = (1_000, 10_000)
+# Kazakhstan bounding box
+LAT_RANGE = (40.5, 55.5)
+LON_RANGE = (46.5, 87.3)
+
+
+def make_depots(n, rnd):
+    return [
+        {'id_point': i, 'namepoint': f"Depot {i}",
+         'latitude': rnd.uniform(*LAT_RANGE), 'longitude': rnd.uniform(*LON_RANGE)}
+        for i in range(n)
+    ]
+
+
+def make_locos(n, rnd):
+    return [
+        {'section': f"S{i}",
+         'latitude': rnd.uniform(*LAT_RANGE), 'longitude': rnd.uniform(*LON_RANGE),
+         'azimuth': -1 if rnd.random() < 0.1 else rnd.uniform(0, 360)}
+        for i in range(n)
+    ]
+
+
+def scalar_matches(locos, depots):
+    approaching, nearby = [], []
+    for loco in locos:
+        lat_l, lon_l, azi_l = loco['latitude'], loco['longitude'], loco['azimuth']
+        for depot in depots:
+            lat_d, lon_d = depot['latitude'], depot['longitude']
+            dist = haversine(lat_l, lon_l, lat_d, lon_d)
+            if APPROACH_MIN_KM <= dist <= APPROACH_MAX_KM and azi_l != -1:
+                brg = bearing(lat_l, lon_l, lat_d, lon_d)
+                diff = min((azi_l - brg) % 360, (brg - azi_l) % 360)
+                if diff <= MAX_COURSE_DIFF:
+                    approaching.append((loco, depot, dist))
+            elif dist < NEARBY_MAX_KM and azi_l == -1:
+                nearby.append((loco, depot, dist))
+    return approaching, nearby
+
+
+def pair_keys(matches):
+    return sorted((loco['section'], depot['id_point']) for loco, depot, _ in matches)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    rnd = random.Random(42)
+    depots = make_depots(DEPOTS, rnd)
+    print(f"{'locos':>8} {'depots':>7} {'scalar, s':>10} {'numpy, s':>10} {'index, s':>10} "
+          f"{'speedup':>8} {'matches':>8}")
+    for n in FLEETS:
+        locos = make_locos(n, rnd)
+        t_scalar, (a_s, n_s) = timed(scalar_matches, locos, depots)
+        t_numpy, (a_v, n_v) = timed(lambda: find_matches(locos, DepotSet(depots)))
+        index = DepotIndex(depots)
+        t_index, (a_i, n_i) = timed(find_matches, locos, index)
+        assert pair_keys(a_s) == pair_keys(a_v) == pair_keys(a_i)
+        assert pair_keys(n_s) == pair_keys(n_v) == pair_keys(n_i)
+        print(f"{n:>8} {DEPOTS:>7} {t_scalar:>10.3f} {t_numpy:>10.3f} {t_index:>10.3f} "
+              f"{t_scalar / t_index:>7.1f}x {len(a_v) + len(n_v):>8}")
+
+
+if __name__ == '__main__':
+    main()
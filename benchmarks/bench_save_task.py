@@ -0,0 +1,112 @@
+# save_task / get_task_buttons cost on a user_tasks table with many rows.
+#
+#   python -m benchmarks.bench_save_task --users 20000 --saves 2000
+#
+# "old" is the previous save_task: read all ids of the user, delete the oldest
+# ones in Python, insert, no indexes (every statement scans the table).
+# "new" is the current schema: migration 1 indexes plus the retention trigger,
+# so save_task is a single INSERT. Both run on a temporary database file.
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from database.sqlite_db import MIGRATIONS, TASKS_PER_USER
+
+CREATE_TABLE = '''
+    CREATE TABLE user_tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER,
+        ttk_number TEXT,
+        description TEXT,
+        month_day TEXT,
+        loco_number TEXT
+    )
+'''
+INSERT = "INSERT INTO user_tasks (telegram_id, ttk_number, description, month_day, loco_number) VALUES (?, ?, ?, ?, ?)"
+BUTTONS = f"SELECT ttk_number, month_day, loco_number FROM user_tasks WHERE telegram_id = ? ORDER BY id DESC LIMIT {TASKS_PER_USER}"
+DESCRIPTION = "SELECT description FROM user_tasks WHERE telegram_id = ? AND ttk_number = ?"
+
+
+def task(telegram_id, n):
+    return (telegram_id, str(100000 + n), "Описание задания " * 8, "05-01 10:00", f"2ТЭ10М-{n % 9999}")
+
+
+def open_db(path, users, migrate):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(CREATE_TABLE)
+    conn.execute("BEGIN")
+    conn.executemany(INSERT, (task(u, u * TASKS_PER_USER + i) for u in range(users) for i in range(TASKS_PER_USER)))
+    conn.execute("COMMIT")
+    if migrate:
+        # Only migration 1 touches user_tasks; later ones need tables this benchmark does not create
+        for statement in MIGRATIONS[0]:
+            conn.execute(statement)
+    return conn
+
+
+def save_old(conn, row):
+    conn.execute("BEGIN IMMEDIATE")
+    ids = [r[0] for r in conn.execute(
+        "SELECT id FROM user_tasks WHERE telegram_id = ? ORDER BY id ASC", (row[0],))]
+    if len(ids) >= TASKS_PER_USER:
+        conn.execute("DELETE FROM user_tasks WHERE id = ?", (ids[0],))
+    conn.execute(INSERT, row)
+    conn.execute("COMMIT")
+
+
+def save_new(conn, row):
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(INSERT, row)
+    conn.execute("COMMIT")
+
+
+def timed(fn, args_list):
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<22} {len(latencies) / sum(latencies):>10.0f} {statistics.median(latencies) * 1e6:>9.0f} "
+          f"{p99 * 1e6:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--saves", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    users = [rng.randrange(args.users) for _ in range(args.saves)]
+    print(f"{args.users * TASKS_PER_USER} rows, {args.saves} saves and reads")
+    print(f"{'':<22} {'ops/s':>10} {'p50, µs':>9} {'p99, µs':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, migrate, save in (("old", False, save_old), ("new", True, save_new)):
+            conn = open_db(os.path.join(tmp, f"{name}.db"), args.users, migrate)
+            report(f"{name} save_task", timed(
+                lambda u, n: save(conn, task(u, n)), [(u, n) for n, u in enumerate(users)]))
+            report(f"{name} get_task_buttons", timed(
+                lambda u: conn.execute(BUTTONS, (u,)).fetchall(), [(u,) for u in users]))
+            report(f"{name} task description", timed(
+                lambda u, n: conn.execute(DESCRIPTION, (u, str(100000 + n))).fetchall(),
+                [(u, n) for n, u in enumerate(users)]))
+            count = conn.execute("SELECT COUNT(*) FROM user_tasks").fetchone()[0]
+            print(f"{name}: {count} rows after saves")
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Latency of POST /send-task/ under parallel load against a running API.
+#
+#   uvicorn app:app --port 8081          (from main/)
+#   python -m benchmarks.bench_send_task --url http://localhost:8081 \
+#       --phone +77010000000,+77010000001,+77010000002 \
+#       --body "ТТК 123456 2024-05-01 10:00 2ТЭ10М-1234" --requests 500 --concurrency 1,10,50
+#
+# Every phone must belong to a registered user and the TTK must exist, otherwise
+# the endpoint answers 404 early and the numbers say little about DB access.
+# Every successful request sends a real Telegram message; requests go to the
+# phones in turn. The send scheduler lets each chat take TG_CHAT_RATE messages
+# per second (1 by default), so with one phone the bot, not the API, sets the
+# pace. List as many phones as the expected req/s, or start the API with a
+# raised TG_CHAT_RATE for the benchmark run.
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = max(0, min(len(values) - 1, round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def make_payloads(phones, body):
+    return [{"phone": phone.strip(), "body": body} for phone in phones.split(",") if phone.strip()]
+
+
+async def run_load(session, url, payloads, total, concurrency, headers):
+    # Request i carries payloads[i % len(payloads)]
+    latencies, statuses = [], {}
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(payloads[i % len(payloads)])
+
+    async def worker():
+        while not queue.empty():
+            payload = queue.get_nowait()
+            start = time.perf_counter()
+            async with session.post(url, json=payload, headers=headers) as resp:
+                await resp.read()
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8081")
+    parser.add_argument("--phone", required=True, help="comma-separated, requests go to each in turn")
+    parser.add_argument("--body", required=True)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", default="1,10,50")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY"))
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/") + "/send-task/"
+    headers = {"x-api-key": args.api_key}
+    payloads = make_payloads(args.phone, args.body)
+
+    print(f"{'parallel':>8} {'req/s':>8} {'p50, ms':>8} {'p99, ms':>8} {'mean, ms':>9}  statuses")
+    async with aiohttp.ClientSession() as session:
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            latencies, statuses, elapsed = await run_load(
+                session, url, payloads, args.requests, concurrency, headers
+            )
+            print(f"{concurrency:>8} {len(latencies) / elapsed:>8.1f} "
+                  f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f} "
+                  f"{statistics.mean(latencies) * 1000:>9.1f}  {statuses}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+# Throughput of N single POST /send-task/ calls versus one POST /send-tasks/ with N items.
+#
+#   uvicorn app:app --port 8081          (from main/)
+#   python -m benchmarks.bench_send_tasks --url http://localhost:8081 \
+#       --phone +77010000000,+77010000001,+77010000002 \
+#       --body "ТТК 123456 2024-05-01 10:00 2ТЭ10М-1234" --items 100,500 --concurrency 10
+#
+# Same requirements as bench_send_task: registered phones and an existing TTK.
+# Every item sends a real Telegram message, 2 * sum(items) messages in total,
+# spread over the phones in turn. As there, a single chat is limited to
+# TG_CHAT_RATE messages per second: pass several phones or raise TG_CHAT_RATE
+# for the run, or both modes measure the per-chat limit.
+import argparse
+import asyncio
+import os
+import time
+
+import aiohttp
+from dotenv import load_dotenv
+
+from benchmarks.bench_send_task import make_payloads, percentile, run_load
+
+load_dotenv()
+
+
+async def run_batch(session, url, payloads, total, headers):
+    started = time.perf_counter()
+    items = [payloads[i % len(payloads)] for i in range(total)]
+    async with session.post(url, json=items, headers=headers) as resp:
+        body = await resp.json()
+        status = resp.status
+    elapsed = time.perf_counter() - started
+    statuses = {}
+    for result in body.get("results", []):
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    return statuses or {status: 1}, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8081")
+    parser.add_argument("--phone", required=True, help="comma-separated, items go to each in turn")
+    parser.add_argument("--body", required=True)
+    parser.add_argument("--items", default="100,500")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="parallel clients for the single-call run")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY"))
+    args = parser.parse_args()
+
+    base = args.url.rstrip("/")
+    headers = {"x-api-key": args.api_key}
+    payloads = make_payloads(args.phone, args.body)
+
+    print(f"{'items':>6} {'mode':<18} {'items/s':>8} {'total, s':>9} {'p99, ms':>8}  statuses")
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        for total in (int(n) for n in args.items.split(",")):
+            latencies, statuses, elapsed = await run_load(
+                session, base + "/send-task/", payloads, total, args.concurrency, headers
+            )
+            print(f"{total:>6} {f'single x{args.concurrency}':<18} {total / elapsed:>8.1f} {elapsed:>9.2f} "
+                  f"{percentile(latencies, 99) * 1000:>8.1f}  {statuses}")
+
+            statuses, elapsed = await run_batch(session, base + "/send-tasks/", payloads, total, headers)
+            print(f"{total:>6} {'batch':<18} {total / elapsed:>8.1f} {elapsed:>9.2f} {'':>8}  {statuses}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
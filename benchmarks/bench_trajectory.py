@@ -0,0 +1,54 @@
+# Update and query cost per fix of the trajectory ring buffer.
+# Run from the repository root: python -m benchmarks.bench_trajectory
+import random
+import time
+
+from additional.depot_index import DepotIndex
+from additional.geo_engine import find_arrivals
+from additional.trajectory import TrajectoryStore
+from benchmarks.bench_geo import LAT_RANGE, LON_RANGE, make_depots
+
+SECTIONS = (1_000, 10_000, 50_000)
+ROUNDS = 10
+FIX_INTERVAL = 60.0  # seconds between fixes
+
+
+def main():
+    rnd = random.Random(7)
+    index = DepotIndex(make_depots(500, rnd))
+    print(f"{'sections':>9} {'push, us/fix':>13} {'motion, us/fix':>15} {'eta, us/fix':>12} {'memory, MB':>11}")
+    for n in SECTIONS:
+        store = TrajectoryStore()
+        sections = [f"S{i}" for i in range(n)]
+        pos = {s: [rnd.uniform(*LAT_RANGE), rnd.uniform(*LON_RANGE)] for s in sections}
+        step = {s: [rnd.uniform(-0.02, 0.02), rnd.uniform(-0.02, 0.02)] for s in sections}
+
+        push_time = motion_time = eta_time = 0.0
+        for r in range(ROUNDS):
+            ts = r * FIX_INTERVAL
+            start = time.perf_counter()
+            for s in sections:
+                p, d = pos[s], step[s]
+                p[0] += d[0]
+                p[1] += d[1]
+                store.push(s, p[0], p[1], ts)
+            push_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            heading, speed, valid = store.motion(sections)
+            motion_time += time.perf_counter() - start
+
+            rows = [{'section': s, 'latitude': pos[s][0], 'longitude': pos[s][1]}
+                    for s, ok in zip(sections, valid) if ok]
+            start = time.perf_counter()
+            find_arrivals(rows, heading[valid], speed[valid], index)
+            eta_time += time.perf_counter() - start
+
+        fixes = n * ROUNDS
+        memory = sum(a.nbytes for a in (store.lat, store.lon, store.ts, store.head, store.count))
+        print(f"{n:>9} {push_time / fixes * 1e6:>13.2f} {motion_time / fixes * 1e6:>15.2f} "
+              f"{eta_time / fixes * 1e6:>12.2f} {memory / 2**20:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# psycopg2 and sqlite3 calls run on this bounded pool instead of the event loop.
+# Two pools (helpdesk + loco) can hold up to 2 * DB_POOL_MAX connections.
+DB_THREADS = int(os.getenv("DB_THREADS", str(2 * int(os.getenv("DB_POOL_MAX", "10")))))
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    # Runs a blocking DB function in the DB thread pool and awaits its result
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
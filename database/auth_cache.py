@@ -0,0 +1,59 @@
+import asyncio
+import os
+import time
+
+from database.async_db import run_db
+from database.cache import TTLCache
+from database.database import get_active_phones
+from database.sqlite_db import check_user_by_telegram_id
+
+AUTH_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+# Unknown telegram ids are remembered for a shorter time
+AUTH_NEGATIVE_TTL = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", "15"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+
+class AuthCache:
+    # telegram_id -> (phone, is_active) for check_user_active_decorator.
+    # is_active comes from a set of active employee phones loaded in one query.
+
+    def __init__(self, ttl=AUTH_TTL, negative_ttl=AUTH_NEGATIVE_TTL, maxsize=AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._users = TTLCache(maxsize, ttl)
+        self._active_phones = set()
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    async def _active(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+            async with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+                    self._active_phones = await run_db(get_active_phones)
+                    self._loaded_at = time.monotonic()
+        return self._active_phones
+
+    async def warm(self):
+        self._loaded_at = None
+        await self._active()
+
+    async def lookup(self, telegram_id: int):
+        # Returns (phone, is_active); phone is None for unregistered users
+        cached = self._users.get(telegram_id)
+        if cached is not None:
+            return cached
+        user = await check_user_by_telegram_id(telegram_id)
+        if not user:
+            result = (None, False)
+            self._users.set(telegram_id, result, ttl=self.negative_ttl)
+            return result
+        phone = user[1]
+        result = (phone, phone in await self._active())
+        self._users.set(telegram_id, result)
+        return result
+
+    def invalidate(self, telegram_id: int = None):
+        self._users.invalidate(telegram_id)
+
+
+auth_cache = AuthCache()
@@ -1,29 +1,215 @@
 from psycopg2.extras import RealDictCursor
+from psycopg2 import extensions
 from fastapi import HTTPException
+from contextlib import contextmanager
+from collections import deque
+from datetime import date
 import os
+import threading
+import time
 import psycopg2
+import psycopg2.pool
 from dotenv import load_dotenv
+from database.async_db import run_db
+from database.cache import TTLCache
 
 load_dotenv()
 
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Idle connections older than this are pinged with SELECT 1 on checkout
+HEALTH_CHECK_IDLE = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", "30"))
+# Idle connections above DB_POOL_MIN are closed after this many seconds
+IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+
+# (ttk_number, year) -> (ticket_id, description). Tickets are edited in the helpdesk,
+# not through this service, so entries only go stale by DESCRIPTION_CACHE_TTL.
+DESCRIPTION_CACHE_SIZE = int(os.getenv("DESCRIPTION_CACHE_SIZE", "1024"))
+DESCRIPTION_CACHE_TTL = float(os.getenv("DESCRIPTION_CACHE_TTL", "600"))
+_description_cache = TTLCache(DESCRIPTION_CACHE_SIZE, DESCRIPTION_CACHE_TTL)
+
+
+class ConnectionPool:
+    # Thread-safe bounded psycopg2 pool; connections are opened lazily.
+
+    def __init__(self, name, connect_kwargs, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT):
+        self.name = name
+        self.connect_kwargs = connect_kwargs
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._idle = deque()  # (conn, returned_at)
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "reconnects": 0,
+            "checkout_time_total": 0.0,
+            "checkout_time_max": 0.0,
+        }
+
+    def _connect(self):
+        return psycopg2.connect(**self.connect_kwargs)
+
+    def _healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - returned_at < HEALTH_CHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, returned_at = None, None
+                    break
+                if not waited:
+                    waited = True
+                    self._stats["waits"] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise psycopg2.pool.PoolError(f"Connection pool '{self.name}' exhausted")
+                self._cond.wait(remaining)
+
+        try:
+            if conn is not None and not self._healthy(conn, returned_at):
+                self._close(conn)
+                conn = None
+                with self._cond:
+                    self._stats["reconnects"] += 1
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["checkout_time_total"] += elapsed
+            self._stats["checkout_time_max"] = max(self._stats["checkout_time_max"], elapsed)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        now = time.monotonic()
+        with self._cond:
+            if discard or conn.closed:
+                self._size -= 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, now))
+            # The oldest idle connections above minconn are closed
+            while len(self._idle) > self.minconn and now - self._idle[0][1] > IDLE_TIMEOUT:
+                stale, _ = self._idle.popleft()
+                self._size -= 1
+                self._close(stale)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        # Same semantics as psycopg2's "with conn:" (commit on success,
+        # rollback on error), but the connection goes back to the pool.
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max"] = self.maxconn
+        checkouts = stats["checkouts"]
+        stats["checkout_time_avg"] = stats["checkout_time_total"] / checkouts if checkouts else 0.0
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._close(conn)
+
+
+helpdesk_pool = ConnectionPool("helpdesk", dict(
+    dbname=os.getenv("DB_NAME1"),
+    user=os.getenv("DB_USER1"),
+    password=os.getenv("DB_PASSWORD1"),
+    host=os.getenv("DB_HOST1"),
+    port=os.getenv("DB_PORT1")
+))
+
+loco_pool = ConnectionPool("loco", dict(
+    dbname=os.getenv("DB_NAME2"),
+    user=os.getenv("DB_USER2"),
+    password=os.getenv("DB_PASSWORD2"),
+    host=os.getenv("DB_HOST2"),
+    port=os.getenv("DB_PORT2")
+))
+
+
 def get_connection():
-    return psycopg2.connect(
-        dbname=os.getenv("DB_NAME1"),
-        user=os.getenv("DB_USER1"),
-        password=os.getenv("DB_PASSWORD1"),
-        host=os.getenv("DB_HOST1"),
-        port=os.getenv("DB_PORT1")
-    )
+    # Usage: with get_connection() as conn: ...
+    return helpdesk_pool.connection()
 
 
 def get_connection2():
-    return psycopg2.connect(
-        dbname=os.getenv("DB_NAME2"),
-        user=os.getenv("DB_USER2"),
-        password=os.getenv("DB_PASSWORD2"),
-        host=os.getenv("DB_HOST2"),
-        port=os.getenv("DB_PORT2")
-    )
+    return loco_pool.connection()
+
+
+def pool_stats():
+    return {pool.name: pool.stats() for pool in (helpdesk_pool, loco_pool)}
+
+
+def close_pools():
+    helpdesk_pool.closeall()
+    loco_pool.closeall()
 
 # def get_connection():
 #     return psycopg2.connect(
@@ -60,18 +246,86 @@ def check_phone_in_postgres(phone: str):
         raise HTTPException(status_code=500, detail=f"Failed to execute query: {str(e)}")
 
 
+def get_depot_phones():
+    # (depot_id, phone) for every employee attached to a depot
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT depot_id, phone
+                    FROM helpdesk_employee
+                    WHERE depot_id IS NOT NULL
+                      AND phone IS NOT NULL
+                      AND phone <> ''
+                    """
+                )
+                return cursor.fetchall()
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Failed to execute query: {str(e)}")
+
+
+def get_active_phones():
+    # Phones of every employee whose auth_user account is active
+    query = """
+        SELECT helpdesk_employee.phone FROM auth_user
+        JOIN helpdesk_employee ON auth_user.id = helpdesk_employee.user_id
+        WHERE auth_user.is_active AND helpdesk_employee.phone IS NOT NULL
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                return {row[0] for row in cursor.fetchall()}
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Failed to execute query: {str(e)}")
+
+
 async def get_full_description(ttk_number: int, year: str):
+    key = (str(ttk_number), int(year))
+    cached = _description_cache.get(key)
+    if cached is not None:
+        return cached
+    result = await run_db(_get_full_description, ttk_number, year)
+    _description_cache.set(key, result)
+    return result
+
+
+async def get_full_descriptions(keys):
+    # (ttk_number, year) -> (ticket_id, description) for many keys; missing TTKs are left out
+    keys = {(str(ttk_number), int(year)) for ttk_number, year in keys}
+    found, missing = {}, []
+    for key in keys:
+        cached = _description_cache.get(key)
+        if cached is not None:
+            found[key] = cached
+        else:
+            missing.append(key)
+    for i in range(0, len(missing), 500):
+        rows = await run_db(_get_full_descriptions, missing[i:i + 500])
+        for key, result in rows.items():
+            _description_cache.set(key, result)
+            found[key] = result
+    return found
+
+
+def _get_full_description(ttk_number: int, year: str):
     ttk_number_with_decimal = f"{ttk_number}"
+    # Range predicate instead of DATE_PART('year', created_in_ttk) so an index on
+    # helpdesk_ticket (ttk_number, created_in_ttk) can be used.
     query = """
         SELECT id, description
         FROM helpdesk_ticket
         WHERE ttk_number = %s
-          AND DATE_PART('year', created_in_ttk) = %s
+          AND created_in_ttk >= %s
+          AND created_in_ttk < %s
+        LIMIT 1
     """
+    year = int(year)
     try:
         with get_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, (ttk_number_with_decimal, year))
+                cursor.execute(query, (ttk_number_with_decimal, date(year, 1, 1), date(year + 1, 1, 1)))
                 row = cursor.fetchone()
                 if not row:
                     raise HTTPException(
@@ -81,4 +335,31 @@ async def get_full_description(ttk_number: int, year: str):
                 ticket_id, description = row
                 return ticket_id, description
     except psycopg2.Error as e:
-        raise HTTPException(status_code=500, detail=f"Failed to execute query: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to execute query: {str(e)}")
+
+
+def _get_full_descriptions(keys):
+    # One round-trip for many (ttk_number, year) pairs, same range predicate as above.
+    # ttk_number is numeric: the text key is cast for the comparison and returned as is.
+    query = """
+        SELECT k.ttk_key, k.year, t.id, t.description
+        FROM unnest(%s::text[], %s::int[]) AS k(ttk_key, year)
+        JOIN LATERAL (
+            SELECT id, description
+            FROM helpdesk_ticket
+            WHERE ttk_number = k.ttk_key::numeric
+              AND created_in_ttk >= make_date(k.year, 1, 1)
+              AND created_in_ttk < make_date(k.year + 1, 1, 1)
+            LIMIT 1
+        ) t ON TRUE
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, ([key[0] for key in keys], [key[1] for key in keys]))
+                return {
+                    (ttk_number, year): (ticket_id, description)
+                    for ttk_number, year, ticket_id, description in cursor.fetchall()
+                }
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Failed to execute query: {str(e)}")
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+# Changed states are written in one batch at most this often
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))
+# States not changed for this long are treated as abandoned and removed
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(24 * 3600)))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+PURGE_INTERVAL = 3600  # seconds
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        updated_at REAL NOT NULL
+    )
+"""
+CREATE_INDEX = "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)"
+UPSERT = """
+    INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("state", "data", "encoded", "updated_at", "checked_at")
+
+    def __init__(self, state, data, encoded, updated_at):
+        self.state = state
+        self.data = data
+        self.encoded = encoded  # data as stored, JSON
+        self.updated_at = updated_at  # time.time() of the last change
+        self.checked_at = time.monotonic()  # when it last matched the database
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    aiogram FSM storage in the WAL-mode users.db, a drop-in for MemoryStorage.
+
+    Reads are served from an LRU cache of recently used keys. Writes update the
+    cache at once and are flushed together every `flush_interval` seconds, so a
+    burst of set_state/set_data for one chat costs one row write; close() flushes
+    what is left. States unchanged for `ttl` seconds are purged.
+
+    A cached entry without pending writes is re-read once it is older than
+    `flush_interval`, so a state written by another bot process sharing the
+    database is picked up as soon as that process has flushed it.
+    """
+
+    def __init__(self, engine, flush_interval: float = FSM_FLUSH_INTERVAL, ttl: float = FSM_STATE_TTL,
+                 cache_size: int = FSM_CACHE_SIZE):
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # key -> _Entry
+        self._dirty = set()
+        self._flush_task = None
+        self._ready = False
+        self._start_lock = None
+        self._last_purge = 0.0
+
+    @staticmethod
+    def _key(key):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{getattr(key, 'thread_id', None) or ''}:{key.destiny}"
+
+    async def _ensure_ready(self):
+        if self._ready:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._ready:
+                return
+            await self.engine.execute(CREATE_TABLE)
+            await self.engine.execute(CREATE_INDEX)
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            self._ready = True
+
+    def _from_row(self, row):
+        if row is None or row[2] < time.time() - self.ttl:
+            return _Entry(None, {}, "{}", 0.0)
+        return _Entry(row[0], json.loads(row[1]), row[1], row[2])
+
+    async def _entry(self, key):
+        await self._ensure_ready()
+        entry = self._cache.get(key)
+        if entry is not None and key not in self._dirty and \
+                time.monotonic() - entry.checked_at >= self.flush_interval:
+            # Another process may have changed or cleared this state since it was cached
+            entry = None
+        if entry is None:
+            row = await self.engine.fetchone("SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,))
+            # A write for this key may have landed in the cache while we were reading
+            if key in self._dirty:
+                entry = self._cache[key]
+            else:
+                entry = self._cache[key] = self._from_row(row)
+                self._evict(keep=key)
+        self._cache.move_to_end(key)
+        return entry
+
+    def _evict(self, keep):
+        # Only entries already written to the database can be dropped
+        while len(self._cache) > self.cache_size:
+            for key in self._cache:
+                if key != keep and key not in self._dirty:
+                    del self._cache[key]
+                    break
+            else:
+                return
+
+    async def set_state(self, key, state=None):
+        key = self._key(key)
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        entry.updated_at = time.time()
+        self._dirty.add(key)
+
+    async def get_state(self, key):
+        return (await self._entry(self._key(key))).state
+
+    async def set_data(self, key, data):
+        # Encoded now, so data that cannot be stored fails in the handler, not in the flush
+        encoded = json.dumps(data, ensure_ascii=False)
+        key = self._key(key)
+        entry = await self._entry(key)
+        entry.data = dict(data)
+        entry.encoded = encoded
+        entry.updated_at = time.time()
+        self._dirty.add(key)
+
+    async def get_data(self, key):
+        return (await self._entry(self._key(key))).data.copy()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in keys:
+            entry = self._cache[key]
+            if entry.state is None and not entry.data:
+                deletes.append((key,))
+            else:
+                upserts.append((key, entry.state, entry.encoded, entry.updated_at))
+        try:
+            if upserts:
+                await self.engine.executemany(UPSERT, upserts)
+            if deletes:
+                await self.engine.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+        except Exception as e:
+            logger.error("Не удалось сохранить состояния FSM: %s", e)
+            self._dirty |= keys
+            return
+        if time.time() - self._last_purge >= PURGE_INTERVAL:
+            await self.purge()
+
+    async def purge(self):
+        cutoff = time.time() - self.ttl
+        self._last_purge = time.time()
+        await self.engine.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,))
+        for key in [k for k, e in self._cache.items() if k not in self._dirty and e.updated_at < cutoff]:
+            del self._cache[key]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка при очистке состояний FSM: %s", e)
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        self._ready = False
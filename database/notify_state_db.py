@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+DB = os.path.join(BASE_DIR, "users.db")
+
+NOTIFY_TTL = 3 * 3600  # seconds
+# monitor.py looks at tickets from the last 24 hours, keep announcements a bit longer
+ANNOUNCEMENT_TTL = 48 * 3600  # seconds
+PURGE_INTERVAL = 3600  # seconds
+# Upper bound for the in-process cache of keys known to be sent
+RECENT_CACHE_SIZE = 10_000
+
+_conn = None
+_lock = threading.Lock()
+_recent = OrderedDict()  # key -> expires_at (time.time())
+_last_purge = 0.0
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB, check_same_thread=False, timeout=30, isolation_level=None)
+        _conn.execute("PRAGMA busy_timeout = 30000")
+    return _conn
+
+
+def init_notify_state_db():
+    with _lock:
+        conn = _get_conn()
+        # Последняя отправка уведомления по ключу "section-id_point"
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS notification_log (
+            key TEXT PRIMARY KEY,
+            sent_at REAL NOT NULL
+          )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_notification_log_sent_at ON notification_log (sent_at)")
+        # Уже отправленные "Локомотив вышел на связь" по заявке и секции
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS monitor_announcements (
+            ticket_id INTEGER NOT NULL,
+            section TEXT NOT NULL,
+            announced_at REAL NOT NULL,
+            PRIMARY KEY (ticket_id, section)
+          )
+        """)
+
+
+def notification_key(namespace: str, section, depot_id):
+    # Each tracker claims keys in its own namespace, so a dry run cannot
+    # suppress real notifications while replicas of one tracker still dedup
+    return f"{namespace}:{section}-{depot_id}"
+
+
+def _remember(key, expires_at):
+    _recent[key] = expires_at
+    _recent.move_to_end(key)
+    while len(_recent) > RECENT_CACHE_SIZE:
+        _recent.popitem(last=False)
+
+
+def _cached(key, now):
+    expires_at = _recent.get(key)
+    if expires_at is None:
+        return False
+    if expires_at <= now:
+        del _recent[key]
+        return False
+    return True
+
+
+def _maybe_purge(conn, now, ttl):
+    global _last_purge
+    if now - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = now
+    conn.execute("DELETE FROM notification_log WHERE sent_at <= ?", (now - ttl,))
+    for key in [k for k, exp in _recent.items() if exp <= now]:
+        del _recent[key]
+
+
+def recently_sent(key: str, ttl: float = NOTIFY_TTL):
+    now = time.time()
+    with _lock:
+        if _cached(key, now):
+            return True
+        row = _get_conn().execute(
+            "SELECT sent_at FROM notification_log WHERE key = ? AND sent_at > ?",
+            (key, now - ttl)
+        ).fetchone()
+        if row:
+            _remember(key, row[0] + ttl)
+        return row is not None
+
+
+def claim(key: str, ttl: float = NOTIFY_TTL):
+    # Atomically marks the key as sent; returns False if it was already sent
+    # (by this or any other process) within the last `ttl` seconds.
+    now = time.time()
+    with _lock:
+        if _cached(key, now):
+            return False
+        conn = _get_conn()
+        _maybe_purge(conn, now, ttl)
+        cur = conn.execute(
+            """
+            INSERT INTO notification_log (key, sent_at) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET sent_at = excluded.sent_at
+            WHERE notification_log.sent_at <= ?
+            """,
+            (key, now, now - ttl)
+        )
+        claimed = cur.rowcount == 1
+        if claimed:
+            _remember(key, now + ttl)
+        return claimed
+
+
+def release(key: str):
+    # Undo a claim when the notification could not be delivered
+    with _lock:
+        _recent.pop(key, None)
+        _get_conn().execute("DELETE FROM notification_log WHERE key = ?", (key,))
+
+
+def filter_unannounced(pairs):
+    # Subset of (ticket_id, section) pairs that were not announced yet
+    pairs = set(pairs)
+    ticket_ids = list({ticket_id for ticket_id, _ in pairs})
+    announced = set()
+    with _lock:
+        conn = _get_conn()
+        for i in range(0, len(ticket_ids), 500):
+            chunk = ticket_ids[i:i + 500]
+            rows = conn.execute(
+                f"SELECT ticket_id, section FROM monitor_announcements WHERE ticket_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            announced.update(rows)
+    return {(ticket_id, section) for ticket_id, section in pairs if (ticket_id, str(section)) not in announced}
+
+
+def mark_announced(pairs):
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO monitor_announcements (ticket_id, section, announced_at) VALUES (?, ?, ?)",
+                [(ticket_id, str(section), now) for ticket_id, section in pairs]
+            )
+            conn.execute("DELETE FROM monitor_announcements WHERE announced_at <= ?", (now - ANNOUNCEMENT_TTL,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
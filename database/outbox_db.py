@@ -0,0 +1,121 @@
+import os
+import time
+import uuid
+
+from database.sqlite_db import engine
+
+# A claimed job whose lease is not renewed is picked up again (e.g. the process
+# died while sending). Workers renew the lease while a delivery is running.
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "60"))
+# Finished jobs are kept this long for the status endpoint
+OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", str(7 * 24 * 3600)))
+
+PENDING = "pending"
+PROCESSING = "processing"
+SENT = "sent"
+FAILED = "failed"
+
+
+async def enqueue(phone: str, body: str):
+    now = time.time()
+    result = await engine.execute(
+        "INSERT INTO task_outbox (phone, body, status, next_attempt_at, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (phone, body, PENDING, now, now, now)
+    )
+    return result.lastrowid
+
+
+async def claim_due(limit: int, lease: float = OUTBOX_LEASE):
+    # Atomically takes up to `limit` due jobs: pending ones whose backoff has
+    # passed and processing ones whose lease expired. Every claim gets a new
+    # token; finishing or renewing a job requires it.
+    # Returns (id, phone, body, attempts, claim_token).
+    async def claim(conn):
+        now = time.time()
+        cursor = await conn.execute(
+            "SELECT id, phone, body, attempts FROM task_outbox "
+            "WHERE status IN (?, ?) AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (PENDING, PROCESSING, now, limit)
+        )
+        jobs = [(job_id, phone, body, attempts + 1, uuid.uuid4().hex)
+                for job_id, phone, body, attempts in await cursor.fetchall()]
+        if jobs:
+            await conn.executemany(
+                "UPDATE task_outbox SET status = ?, attempts = ?, claim_token = ?, next_attempt_at = ?, "
+                "updated_at = ? WHERE id = ?",
+                [(PROCESSING, attempts, token, now + lease, now, job_id) for job_id, _, _, attempts, token in jobs]
+            )
+        return jobs
+
+    return await engine.transaction(claim)
+
+
+async def _update_claimed(job_id: int, token: str, assignments: str, params):
+    # Applies the update only while the claim is still ours; returns whether it was
+    result = await engine.execute(
+        f"UPDATE task_outbox SET {assignments} WHERE id = ? AND status = ? AND claim_token = ?",
+        (*params, job_id, PROCESSING, token)
+    )
+    return result.rowcount == 1
+
+
+async def renew_lease(job_id: int, token: str, lease: float = OUTBOX_LEASE):
+    now = time.time()
+    return await _update_claimed(job_id, token, "next_attempt_at = ?, updated_at = ?", (now + lease, now))
+
+
+async def mark_sent(job_id: int, token: str):
+    return await _update_claimed(
+        job_id, token, "status = ?, last_error = NULL, updated_at = ?", (SENT, time.time())
+    )
+
+
+async def mark_retry(job_id: int, token: str, error: str, delay: float):
+    now = time.time()
+    return await _update_claimed(
+        job_id, token, "status = ?, last_error = ?, next_attempt_at = ?, updated_at = ?",
+        (PENDING, error, now + delay, now)
+    )
+
+
+async def mark_failed(job_id: int, token: str, error: str):
+    return await _update_claimed(
+        job_id, token, "status = ?, last_error = ?, updated_at = ?", (FAILED, error, time.time())
+    )
+
+
+async def get_job(job_id: int):
+    row = await engine.fetchone(
+        "SELECT id, status, attempts, last_error, created_at, updated_at, next_attempt_at "
+        "FROM task_outbox WHERE id = ?",
+        (job_id,)
+    )
+    if row is None:
+        return None
+    job_id, status, attempts, last_error, created_at, updated_at, next_attempt_at = row
+    return {
+        "id": job_id,
+        "status": status,
+        "attempts": attempts,
+        "last_error": last_error,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "next_attempt_at": next_attempt_at if status == PENDING else None,
+    }
+
+
+async def next_due_at():
+    row = await engine.fetchone(
+        "SELECT MIN(next_attempt_at) FROM task_outbox WHERE status IN (?, ?)",
+        (PENDING, PROCESSING)
+    )
+    return row[0] if row else None
+
+
+async def purge_finished(retention: float = OUTBOX_RETENTION):
+    result = await engine.execute(
+        "DELETE FROM task_outbox WHERE status IN (?, ?) AND updated_at < ?",
+        (SENT, FAILED, time.time() - retention)
+    )
+    return result.rowcount
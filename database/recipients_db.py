@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from database.async_db import run_db
+from database.database import get_depot_phones
+from database.sqlite_db import get_notification_chats
+
+RECIPIENTS_TTL = 300  # seconds
+
+
+def normalize_phone(phone: str):
+    return phone if phone.startswith('+') else '+' + phone
+
+
+class RecipientDirectory:
+    # depot_id -> Telegram chat ids of its employees with notifications enabled.
+    # Built from one helpdesk query and one SQLite query, refreshed every `ttl` seconds.
+    # Depot ids come from two databases (helpdesk_employee.depot_id, refuelingpoint.id_point),
+    # so they are keyed as strings.
+
+    def __init__(self, ttl: float = RECIPIENTS_TTL):
+        self.ttl = ttl
+        self._by_depot = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    def _expired(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    async def refresh(self):
+        depot_phones = await run_db(get_depot_phones)
+        chats = await get_notification_chats()
+
+        by_depot = {}
+        for depot_id, phone in depot_phones:
+            telegram_id = chats.get(normalize_phone(phone))
+            if telegram_id is None:
+                continue
+            ids = by_depot.setdefault(str(depot_id), [])
+            if telegram_id not in ids:
+                ids.append(telegram_id)
+        self._by_depot = by_depot
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    async def get(self, depot_id):
+        if self._expired():
+            async with self._lock:
+                if self._expired():
+                    await self.refresh()
+        return self._by_depot.get(str(depot_id), [])
+
+
+recipients = RecipientDirectory()
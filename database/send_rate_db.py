@@ -0,0 +1,110 @@
+import asyncio
+import time
+import uuid
+
+# A process's waiting lane counts for the others only while it keeps retrying
+LANE_TTL = 2.0  # seconds
+
+CREATE_RATE = """
+    CREATE TABLE IF NOT EXISTS send_rate (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+"""
+CREATE_LANES = """
+    CREATE TABLE IF NOT EXISTS send_lanes (
+        owner TEXT PRIMARY KEY,
+        priority INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    )
+"""
+SAVE_RATE = """
+    INSERT INTO send_rate (id, tokens, updated_at) VALUES (1, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+"""
+SAVE_LANE = """
+    INSERT INTO send_lanes (owner, priority, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT (owner) DO UPDATE SET priority = excluded.priority, updated_at = excluded.updated_at
+"""
+
+
+class SharedRateLimit:
+    """
+    Token bucket for one bot token kept in users.db, so bot.py, monitor.py,
+    the tracker and the API, each a separate process, share one send rate.
+
+    Every process also records the most urgent priority lane it has waiting.
+    A token is only handed out to a request whose lane is at least as urgent as
+    every other process's waiting lane, so an interactive reply in the bot
+    process goes ahead of the tracker's bulk fan-out.
+    """
+
+    def __init__(self, engine, rate: float, burst: float):
+        self.engine = engine
+        self.rate = rate
+        self.burst = burst
+        self.owner = uuid.uuid4().hex
+        self._ready = False
+        self._start_lock = None
+
+    async def _ensure_ready(self):
+        if self._ready:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._ready:
+                return
+            await self.engine.execute(CREATE_RATE)
+            await self.engine.execute(CREATE_LANES)
+            self._ready = True
+
+    async def _tokens(self, conn, now):
+        cursor = await conn.execute("SELECT tokens, updated_at FROM send_rate WHERE id = 1")
+        row = await cursor.fetchone()
+        if row is None:
+            return self.burst
+        return min(self.burst, row[0] + max(0.0, now - row[1]) * self.rate)
+
+    async def acquire(self, priority: int, waiting=None):
+        # Takes a token for a request of `priority`; `waiting` is the most urgent
+        # lane this process still has queued after it, or None. Returns 0 when
+        # the token was taken, otherwise the seconds to wait before asking again.
+        await self._ensure_ready()
+
+        async def take(conn):
+            now = time.time()
+            tokens = await self._tokens(conn, now)
+            cursor = await conn.execute(
+                "SELECT MIN(priority) FROM send_lanes WHERE owner != ? AND updated_at > ?",
+                (self.owner, now - LANE_TTL)
+            )
+            urgent = (await cursor.fetchone())[0]
+            if tokens < 1 or (urgent is not None and urgent < priority):
+                await conn.execute(SAVE_LANE, (self.owner, priority, now))
+                # Retry within LANE_TTL so the lane stays visible to the others
+                return min(max(1 - tokens, 1) / self.rate, LANE_TTL / 2)
+            await conn.execute(SAVE_RATE, (tokens - 1, now))
+            if waiting is None:
+                await conn.execute("DELETE FROM send_lanes WHERE owner = ?", (self.owner,))
+            else:
+                await conn.execute(SAVE_LANE, (self.owner, waiting, now))
+            return 0.0
+
+        return await self.engine.transaction(take)
+
+    async def pause(self, seconds: float):
+        # After a 429 no process may send for `seconds`
+        await self._ensure_ready()
+
+        async def drain(conn):
+            now = time.time()
+            tokens = await self._tokens(conn, now)
+            await conn.execute(SAVE_RATE, (min(tokens, -seconds * self.rate), now))
+
+        await self.engine.transaction(drain)
+
+    async def leave(self):
+        if self._ready:
+            await self.engine.execute("DELETE FROM send_lanes WHERE owner = ?", (self.owner,))
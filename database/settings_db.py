@@ -1,53 +1,144 @@
 import os
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
+from database.async_db import run_db
+
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DB = os.path.join(BASE_DIR, "users.db")
 
+# How often the cached settings are checked against change_counters['settings']
+SETTINGS_CHECK_INTERVAL = float(os.getenv("SETTINGS_CHECK_INTERVAL", "5"))
+
+_conn = None
+_lock = threading.Lock()
+_settings = {}  # key -> value, the whole settings table
+_version = None
+_checked_at = None
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB, check_same_thread=False, timeout=30, isolation_level=None)
+        _conn.execute("PRAGMA busy_timeout = 30000")
+    return _conn
+
+
 def init_settings_db():
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    # Таблица для хранения текущего домена
-    cur.execute("""
-      CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT
-      )
-    """)
-    # История изменений
-    cur.execute("""
-      CREATE TABLE IF NOT EXISTS domain_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        old_value TEXT,
-        new_value TEXT,
-        changed_by TEXT,
-        changed_at TEXT
-      )
-    """)
-    conn.commit()
-    conn.close()
+    with _lock:
+        conn = _get_conn()
+        # Таблица для хранения текущего домена
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+          )
+        """)
+        # История изменений
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS domain_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            old_value TEXT,
+            new_value TEXT,
+            changed_by TEXT,
+            changed_at TEXT
+          )
+        """)
+        # Счётчик изменений settings, по нему процессы замечают правки из админ-бота
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS change_counters (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("INSERT OR IGNORE INTO change_counters (name, version) VALUES ('settings', 0)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+              CREATE TRIGGER IF NOT EXISTS settings_version_{event.lower()} AFTER {event} ON settings
+              BEGIN
+                UPDATE change_counters SET version = version + 1 WHERE name = 'settings';
+              END
+            """)
 
-def get_domain():
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM settings WHERE key='domain'")
-    row = cur.fetchone()
-    conn.close()
+
+def _read_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM change_counters WHERE name = 'settings'").fetchone()
+    except sqlite3.OperationalError:
+        # init_settings_db has not run yet: reload on every check
+        return None
     return row[0] if row else None
 
+
+def _stale():
+    return _checked_at is None or time.monotonic() - _checked_at >= SETTINGS_CHECK_INTERVAL
+
+
+def _refresh():
+    global _settings, _version, _checked_at
+    with _lock:
+        if not _stale():
+            return
+        conn = _get_conn()
+        version = _read_version(conn)
+        if version is None or version != _version:
+            _settings = dict(conn.execute("SELECT key, value FROM settings").fetchall())
+            _version = version
+        _checked_at = time.monotonic()
+
+
+def get_setting(key: str, default=None):
+    if _stale():
+        _refresh()
+    return _settings.get(key, default)
+
+
+async def get_setting_async(key: str, default=None):
+    if _stale():
+        await run_db(_refresh)
+    return _settings.get(key, default)
+
+
+def invalidate_settings():
+    global _checked_at, _version
+    with _lock:
+        _checked_at = None
+        _version = None
+
+
+def get_domain():
+    return get_setting("domain")
+
+
+async def get_domain_async():
+    return await get_setting_async("domain")
+
+
 def set_domain(new_domain: str, changer_phone: str):
-    old = get_domain()
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    if old is None:
-        cur.execute("INSERT INTO settings (key, value) VALUES ('domain', ?)", (new_domain,))
-    else:
-        cur.execute("UPDATE settings SET value = ? WHERE key='domain'", (new_domain,))
-    cur.execute(
-        "INSERT INTO domain_history (old_value, new_value, changed_by, changed_at) VALUES (?, ?, ?, ?)",
-        (old, new_domain, changer_phone, datetime.utcnow().isoformat())
-    )
-    conn.commit()
-    conn.close()
+    global _version, _checked_at
+    with _lock:
+        conn = _get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM settings WHERE key='domain'").fetchone()
+            old = row[0] if row else None
+            if row is None:
+                conn.execute("INSERT INTO settings (key, value) VALUES ('domain', ?)", (new_domain,))
+            else:
+                conn.execute("UPDATE settings SET value = ? WHERE key='domain'", (new_domain,))
+            conn.execute(
+                "INSERT INTO domain_history (old_value, new_value, changed_by, changed_at) VALUES (?, ?, ?, ?)",
+                (old, new_domain, changer_phone, datetime.utcnow().isoformat())
+            )
+            version = _read_version(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        # Write-through; if someone else changed settings meanwhile, reload on next read
+        _settings["domain"] = new_domain
+        if version is not None and _version is not None and version == _version + 1:
+            _version = version
+        else:
+            _checked_at = None
     print("изменен домен на:", new_domain)
@@ -1,128 +1,162 @@
 import os
 import aiosqlite
-import asyncio
-import psycopg2
-from fastapi import HTTPException
-from database.database import get_connection
+from database.sqlite_engine import SQLiteEngine
+from database.user_directory import UserDirectory
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DB = os.path.join(BASE_DIR, "users.db")
 
-_db_conn = None
-_db_lock = asyncio.Lock()
+engine = SQLiteEngine(DB)
+user_directory = UserDirectory(engine)
 
-async def get_db_connection():
-    global _db_conn
-    if _db_conn is None:
-        _db_conn = await aiosqlite.connect(DB, check_same_thread=False)
-    return _db_conn
+# Сколько последних заданий хранится на пользователя
+TASKS_PER_USER = 5
+
+# Schema migrations applied by init_db, tracked in PRAGMA user_version
+MIGRATIONS = [
+    # 1: indexes for per-user task lookups and in-database "last 5 tasks" retention
+    [
+        "CREATE INDEX IF NOT EXISTS idx_user_tasks_telegram_id_id ON user_tasks (telegram_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_user_tasks_telegram_id_ttk ON user_tasks (telegram_id, ttk_number)",
+        f"""
+        DELETE FROM user_tasks
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY telegram_id ORDER BY id DESC) AS rn
+                FROM user_tasks
+            ) WHERE rn > {TASKS_PER_USER}
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS user_tasks_keep_last AFTER INSERT ON user_tasks
+        BEGIN
+            DELETE FROM user_tasks
+            WHERE telegram_id = NEW.telegram_id
+              AND id <= (
+                  SELECT id FROM user_tasks
+                  WHERE telegram_id = NEW.telegram_id
+                  ORDER BY id DESC
+                  LIMIT 1 OFFSET {TASKS_PER_USER}
+              );
+        END
+        """,
+    ],
+    # 2: users version counter, lets every process's UserDirectory notice changes
+    [
+        "CREATE TABLE IF NOT EXISTS change_counters (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR IGNORE INTO change_counters (name, version) VALUES ('users', 0)",
+    ] + [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS users_version_{event.lower()} AFTER {event} ON users
+        BEGIN
+            UPDATE change_counters SET version = version + 1 WHERE name = 'users';
+        END
+        """
+        for event in ("INSERT", "UPDATE", "DELETE")
+    ],
+    # 3: durable outbox of /send-task/ requests accepted in async mode (see outbox_db)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS task_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_task_outbox_status_next ON task_outbox (status, next_attempt_at)",
+    ],
+    # 4: token of the current claim, so a worker whose lease was taken over cannot finish the job
+    [
+        "ALTER TABLE task_outbox ADD COLUMN claim_token TEXT",
+    ],
+]
 
 async def init_db():
-    async with _db_lock:
-        conn = await get_db_connection()
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phone TEXT UNIQUE,
-                telegram_id INTEGER UNIQUE,
-                notifications_enabled BOOLEAN DEFAULT 1
-            );
-        ''')
-        await conn.commit()
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER,
-                ttk_number TEXT,
-                description TEXT,
-                month_day TEXT,    
-                loco_number TEXT
-            );
-        ''')
-        await conn.commit()
+    await engine.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone TEXT UNIQUE,
+            telegram_id INTEGER UNIQUE,
+            notifications_enabled BOOLEAN DEFAULT 1
+        );
+    ''')
+    await engine.execute('''
+        CREATE TABLE IF NOT EXISTS user_tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER,
+            ttk_number TEXT,
+            description TEXT,
+            month_day TEXT,    
+            loco_number TEXT
+        );
+    ''')
+    await engine.transaction(migrate)
+
+async def migrate(conn):
+    cursor = await conn.execute("PRAGMA user_version")
+    version = (await cursor.fetchone())[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            await conn.execute(statement)
+        await conn.execute(f"PRAGMA user_version = {number}")
 
 async def add_user(phone: str, telegram_id: int):
-    async with _db_lock:
-        conn = await get_db_connection()
-        try:
-            await conn.execute(
-                "INSERT INTO users (phone, telegram_id) VALUES (?, ?)",
-                (phone, telegram_id)
-            )
-            await conn.commit()
-        except aiosqlite.IntegrityError:
-            raise ValueError("Пользователь уже существует в базе данных.")
+    try:
+        await user_directory.add(phone, telegram_id)
+    except aiosqlite.IntegrityError:
+        raise ValueError("Пользователь уже существует в базе данных.")
 
 async def check_user_by_telegram_id(telegram_id: int):
-    async with _db_lock:
-        conn = await get_db_connection()
-        cursor = await conn.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
-        user = await cursor.fetchone()
-        return user
+    return await user_directory.by_telegram_id(telegram_id)
 
 async def check_user_by_phone(phone: str):
-    async with _db_lock:
-        conn = await get_db_connection()
-        cursor = await conn.execute("SELECT * FROM users WHERE phone = ?", (phone,))
-        user = await cursor.fetchone()
-        return user
+    return await user_directory.by_phone(phone)
 
 async def update_notifications_status(telegram_id: int, enabled: bool):
-    async with _db_lock:
-        conn = await get_db_connection()
-        await conn.execute(
-            "UPDATE users SET notifications_enabled = ? WHERE telegram_id = ?",
-            (int(enabled), telegram_id)
-        )
-        await conn.commit()
+    await user_directory.set_notifications(telegram_id, enabled)
 
 async def get_notifications_status(telegram_id: int):
-    async with _db_lock:
-        conn = await get_db_connection()
-        cursor = await conn.execute("SELECT notifications_enabled FROM users WHERE telegram_id = ?", (telegram_id,))
-        result = await cursor.fetchone()
-        return result[0] if result else 1
+    user = await user_directory.by_telegram_id(telegram_id)
+    return user[3] if user else 1
+
+async def get_notification_chats():
+    return await user_directory.notification_chats()
+
+async def get_users_by_phones(phones):
+    # phone -> (telegram_id, notifications_enabled) for the given phones
+    return {
+        phone: (user[2], user[3])
+        for phone, user in (await user_directory.by_phones(phones)).items()
+    }
 
 async def save_task(telegram_id: int, ttk_number: str, description: str, month_day: str, loco_number: str):
-    async with _db_lock:
-        conn = await get_db_connection()
-        print("=== save_task called ===")
-        print("DB path:", os.path.abspath(DB))
-        cursor = await conn.execute("SELECT id FROM user_tasks WHERE telegram_id = ? ORDER BY id ASC", (telegram_id,))
-        tasks = await cursor.fetchall()
-        if len(tasks) >= 5:
-            id_to_delete = tasks[0][0]
-            await conn.execute("DELETE FROM user_tasks WHERE id = ?", (id_to_delete,))
-        await conn.execute(
-            "INSERT INTO user_tasks (telegram_id, ttk_number, description, month_day, loco_number) VALUES (?, ?, ?, ?, ?)",
-            (telegram_id, ttk_number, description, month_day, loco_number)
-        )
-        await conn.commit()
-        print("Commit done.")
+    # Older tasks beyond TASKS_PER_USER are removed by the user_tasks_keep_last trigger
+    await engine.execute(
+        "INSERT INTO user_tasks (telegram_id, ttk_number, description, month_day, loco_number) VALUES (?, ?, ?, ?, ?)",
+        (telegram_id, ttk_number, description, month_day, loco_number)
+    )
 
 async def get_user_tasks(telegram_id: int):
-    async with _db_lock:
-        conn = await get_db_connection()
-        cursor = await conn.execute(
-            "SELECT ttk_number, description FROM user_tasks WHERE telegram_id = ? ORDER BY id DESC LIMIT 5",
-            (telegram_id,)
-        )
-        tasks = await cursor.fetchall()
-        return tasks
-
-async def check_user_active(phone: str):
-    query = """
-        SELECT is_active FROM auth_user 
-        JOIN helpdesk_employee ON auth_user.id = helpdesk_employee.user_id
-        WHERE helpdesk_employee.phone = %s
-    """
-    try:
-        with get_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(query, (phone,))
-                result = cursor.fetchone()
-                if result:
-                    return result[0]
-                return False
-    except psycopg2.Error as e:
-        raise HTTPException(status_code=500, detail=f"Failed to execute query: {str(e)}")
+    return await engine.fetchall(
+        f"SELECT ttk_number, description FROM user_tasks WHERE telegram_id = ? ORDER BY id DESC LIMIT {TASKS_PER_USER}",
+        (telegram_id,)
+    )
+
+async def get_task_buttons(telegram_id: int):
+    return await engine.fetchall(
+        f"SELECT ttk_number, month_day, loco_number FROM user_tasks WHERE telegram_id = ? ORDER BY id DESC LIMIT {TASKS_PER_USER}",
+        (telegram_id,)
+    )
+
+async def get_task_description(telegram_id: int, ttk_number: str):
+    row = await engine.fetchone(
+        "SELECT description FROM user_tasks WHERE telegram_id = ? AND ttk_number = ?",
+        (telegram_id, ttk_number)
+    )
+    return row[0] if row else None
@@ -0,0 +1,169 @@
+import asyncio
+import os
+from collections import namedtuple
+
+import aiosqlite
+
+READERS = int(os.getenv("SQLITE_READERS", "4"))
+# Writes queued while a batch commits are grouped into the next transaction
+WRITE_BATCH_SIZE = int(os.getenv("SQLITE_WRITE_BATCH_SIZE", "64"))
+BUSY_TIMEOUT_MS = 30000
+
+WriteResult = namedtuple("WriteResult", ["rowcount", "lastrowid"])
+
+
+class _WriteOp:
+    __slots__ = ("sql", "params", "many", "fn", "future")
+
+    def __init__(self, sql=None, params=(), many=False, fn=None):
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.fn = fn
+        self.future = asyncio.get_running_loop().create_future()
+
+
+async def _connect(path):
+    conn = await aiosqlite.connect(path, isolation_level=None)
+    await conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return conn
+
+
+class SQLiteEngine:
+    """
+    WAL-mode SQLite access for the async code: a small pool of read
+    connections and one writer task that drains a queue and commits
+    queued writes together (group commit). Every write runs in its own
+    savepoint, so a failing statement only fails its own caller.
+    """
+
+    def __init__(self, path, readers=READERS, batch_size=WRITE_BATCH_SIZE):
+        self.path = path
+        self.readers = readers
+        self.batch_size = batch_size
+        self._readers = None
+        self._writer = None
+        self._queue = None
+        self._writer_task = None
+        self._start_lock = None
+
+    async def _ensure_started(self):
+        if self._writer_task is not None:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._writer_task is not None:
+                return
+            self._writer = await _connect(self.path)
+            await self._writer.execute("PRAGMA journal_mode = WAL")
+            await self._writer.execute("PRAGMA synchronous = NORMAL")
+            self._readers = asyncio.Queue()
+            for _ in range(self.readers):
+                self._readers.put_nowait(await _connect(self.path))
+            self._queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._write_loop())
+
+    # ── reads ────────────────────────────────────────────────────────────────
+
+    async def fetchall(self, sql, params=()):
+        await self._ensure_started()
+        conn = await self._readers.get()
+        try:
+            cursor = await conn.execute(sql, params)
+            return await cursor.fetchall()
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def fetchone(self, sql, params=()):
+        await self._ensure_started()
+        conn = await self._readers.get()
+        try:
+            cursor = await conn.execute(sql, params)
+            return await cursor.fetchone()
+        finally:
+            self._readers.put_nowait(conn)
+
+    # ── writes ───────────────────────────────────────────────────────────────
+
+    async def _submit(self, op):
+        await self._ensure_started()
+        self._queue.put_nowait(op)
+        return await op.future
+
+    async def execute(self, sql, params=()):
+        # Resolves after the statement has been committed
+        return await self._submit(_WriteOp(sql, params))
+
+    async def executemany(self, sql, seq_of_params):
+        return await self._submit(_WriteOp(sql, list(seq_of_params), many=True))
+
+    async def transaction(self, fn):
+        # Runs `await fn(conn)` on the writer connection inside the batch
+        # transaction, for read-modify-write sequences that must be atomic.
+        return await self._submit(_WriteOp(fn=fn))
+
+    async def _write_loop(self):
+        # A None in the queue (see close) stops the loop after earlier writes
+        while True:
+            op = await self._queue.get()
+            if op is None:
+                return
+            batch, stop = [op], False
+            while len(batch) < self.batch_size and not self._queue.empty():
+                op = self._queue.get_nowait()
+                if op is None:
+                    stop = True
+                    break
+                batch.append(op)
+            await self._commit_batch(batch)
+            if stop:
+                return
+
+    async def _run_op(self, op):
+        conn = self._writer
+        if op.fn is not None:
+            return await op.fn(conn)
+        if op.many:
+            cursor = await conn.executemany(op.sql, op.params)
+        else:
+            cursor = await conn.execute(op.sql, op.params)
+        return WriteResult(cursor.rowcount, cursor.lastrowid)
+
+    async def _commit_batch(self, batch):
+        conn = self._writer
+        results = []
+        try:
+            await conn.execute("BEGIN IMMEDIATE")
+            for op in batch:
+                await conn.execute("SAVEPOINT op")
+                try:
+                    results.append((op, await self._run_op(op), None))
+                    await conn.execute("RELEASE op")
+                except Exception as e:
+                    await conn.execute("ROLLBACK TO op")
+                    await conn.execute("RELEASE op")
+                    results.append((op, None, e))
+            await conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                await conn.execute("ROLLBACK")
+            results = [(op, None, e) for op in batch]
+
+        for op, result, error in results:
+            if op.future.done():
+                continue
+            if error is not None:
+                op.future.set_exception(error)
+            else:
+                op.future.set_result(result)
+
+    async def close(self):
+        if self._writer_task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._writer_task
+        self._writer_task = None
+        await self._writer.close()
+        while not self._readers.empty():
+            await self._readers.get_nowait().close()
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+
+import aiosqlite
+
+# How often a process checks the users version counter for changes made elsewhere
+CHECK_INTERVAL = float(os.getenv("USER_DIRECTORY_CHECK_INTERVAL", "1"))
+
+USER_COLUMNS = "id, phone, telegram_id, notifications_enabled"
+
+
+class UserDirectory:
+    # In-memory copy of the users table indexed by phone and telegram_id.
+    # Rows have the `SELECT * FROM users` shape: (id, phone, telegram_id, notifications_enabled).
+    # Writes from this process are applied write-through; writes from other
+    # processes are noticed via change_counters['users'], bumped by triggers.
+
+    def __init__(self, engine, check_interval: float = CHECK_INTERVAL):
+        self.engine = engine
+        self.check_interval = check_interval
+        self._by_phone = {}
+        self._by_telegram_id = {}
+        self._version = None
+        self._checked_at = None
+        self._lock = asyncio.Lock()
+        self.reloads = 0
+
+    async def _read_version(self, conn=None):
+        sql = "SELECT version FROM change_counters WHERE name = 'users'"
+        try:
+            if conn is None:
+                row = await self.engine.fetchone(sql)
+            else:
+                row = await (await conn.execute(sql)).fetchone()
+        except aiosqlite.OperationalError:
+            # init_db has not created change_counters yet: reload on every check
+            return None
+        return row[0] if row else None
+
+    async def reload(self):
+        # Version is read before the rows, so the snapshot is never older than it
+        version = await self._read_version()
+        rows = await self.engine.fetchall(f"SELECT {USER_COLUMNS} FROM users")
+        self._by_phone = {row[1]: row for row in rows}
+        self._by_telegram_id = {row[2]: row for row in rows if row[2] is not None}
+        self._version = version
+        self._checked_at = time.monotonic()
+        self.reloads += 1
+
+    async def _refresh(self):
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        async with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return
+            version = await self._read_version() if self._checked_at is not None else None
+            if version is None or version != self._version:
+                await self.reload()
+            else:
+                self._checked_at = time.monotonic()
+
+    def _store(self, row, version):
+        # Called with the version read in the same transaction as the write.
+        # If anything else was written in between, the next check reloads.
+        old = self._by_telegram_id.get(row[2])
+        if old is not None and old[1] != row[1]:
+            self._by_phone.pop(old[1], None)
+        self._by_phone[row[1]] = row
+        if row[2] is not None:
+            self._by_telegram_id[row[2]] = row
+        if version is None or self._version is None or version != self._version + 1:
+            self._checked_at = None
+        else:
+            self._version = version
+
+    async def add(self, phone: str, telegram_id: int):
+        async def insert(conn):
+            cursor = await conn.execute(
+                "INSERT INTO users (phone, telegram_id) VALUES (?, ?)", (phone, telegram_id)
+            )
+            return cursor.lastrowid, await self._read_version(conn)
+
+        user_id, version = await self.engine.transaction(insert)
+        self._store((user_id, phone, telegram_id, 1), version)
+
+    async def set_notifications(self, telegram_id: int, enabled: bool):
+        async def update(conn):
+            await conn.execute(
+                "UPDATE users SET notifications_enabled = ? WHERE telegram_id = ?",
+                (int(enabled), telegram_id)
+            )
+            cursor = await conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE telegram_id = ?", (telegram_id,))
+            return await cursor.fetchone(), await self._read_version(conn)
+
+        row, version = await self.engine.transaction(update)
+        if row is not None:
+            self._store(row, version)
+
+    async def by_phone(self, phone: str):
+        await self._refresh()
+        return self._by_phone.get(phone)
+
+    async def by_telegram_id(self, telegram_id: int):
+        await self._refresh()
+        return self._by_telegram_id.get(telegram_id)
+
+    async def by_phones(self, phones):
+        await self._refresh()
+        return {phone: self._by_phone[phone] for phone in phones if phone in self._by_phone}
+
+    async def notification_chats(self):
+        # phone -> telegram_id for every user with notifications enabled
+        await self._refresh()
+        return {
+            phone: row[2] for phone, row in self._by_phone.items()
+            if row[3] and row[2] is not None
+        }
+
+    def invalidate(self):
+        self._checked_at = None
+        self._version = None
@@ -1,12 +1,17 @@
 import asyncio
-import math
 import os
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from dotenv import load_dotenv
-import psycopg2
 import psycopg2.extras
 
+from additional.depot_index import get_depot_index
+from additional.loco_feed import LocomotiveFeed
+from additional.tickets import fetch_tickets, section_key
+from database import notify_state_db
+from database.async_db import run_db
+from database.database import close_pools, get_connection2
+
 # ──────────────────────────────────────────────────────────────────────────────
 # 1) Загрузка .env
 load_dotenv()
@@ -15,138 +20,79 @@ load_dotenv()
 TEST_DIR = 'test_messages'
 os.makedirs(TEST_DIR, exist_ok=True)
 
-EARTH_RADIUS_KM = 6371.0
 MESSAGE_TIMEOUT = timedelta(hours=3)
 
-# Кэш отправленных сообщений: ключ — "section-id_point", значение — datetime последней отправки
-last_sent_messages: dict[str, datetime] = {}
+# Отправленные сообщения: ключ — "test:section-id_point", хранятся в users.db
+# (общие для всех экземпляров тестового трекера и переживают перезапуск;
+# отдельное пространство ключей не мешает рабочему трекеру)
+NOTIFY_NAMESPACE = "test"
+notify_state_db.init_notify_state_db()
 
-# ──────────────────────────────────────────────────────────────────────────────
-# 3) Открываем постоянные соединения к БД
-conn_helpdesk = psycopg2.connect(
-    dbname=os.getenv("DB_NAME1"),
-    user=os.getenv("DB_USER1"),
-    password=os.getenv("DB_PASSWORD1"),
-    host=os.getenv("DB_HOST1"),
-    port=os.getenv("DB_PORT1")
-)
-conn_loco = psycopg2.connect(
-    dbname=os.getenv("DB_NAME2"),
-    user=os.getenv("DB_USER2"),
-    password=os.getenv("DB_PASSWORD2"),
-    host=os.getenv("DB_HOST2"),
-    port=os.getenv("DB_PORT2")
-)
+# Последние известные позиции секций и watermark по dt
+feed = LocomotiveFeed()
 
 # ──────────────────────────────────────────────────────────────────────────────
-# 4) Вспомогательные функции гео
-def haversine(lat1, lon1, lat2, lon2):
-    lat1_rad, lat2_rad = map(math.radians, (lat1, lat2))
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return EARTH_RADIUS_KM * c
-
-def bearing(lat1, lon1, lat2, lon2):
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    dlon_rad = math.radians(lon2 - lon1)
-    x = math.sin(dlon_rad) * math.cos(lat2_rad)
-    y = math.cos(lat1_rad)*math.sin(lat2_rad) - \
-        math.sin(lat1_rad)*math.cos(lat2_rad)*math.cos(dlon_rad)
-    azimuth = math.degrees(math.atan2(x, y))
-    return (azimuth + 360) % 360
+# 3) Соединения к БД берутся из пулов database.database
+#    (helpdesk — get_connection в additional.tickets, локомотивы — get_connection2)
 
 # ──────────────────────────────────────────────────────────────────────────────
-# 5) Основная логика опроса и отправки
+# 4) Основная логика опроса и отправки
+
+def load_depots_and_positions():
+    with get_connection2() as conn_loco:
+        with conn_loco.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur2:
+            cur2.execute("SELECT id_point, namepoint, latitude, longitude FROM refuelingpoint")
+            depots = cur2.fetchall()
+            changed = feed.poll(cur2)
+    return depots, changed
 
 async def process_tracking():
     print("[TRACE] process_tracking started")
 
-    # 5.1. Загружаем депо и локомотивы разными курсорами на одном соединении
-    cur2 = conn_loco.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    try:
-        cur2.execute("SELECT id_point, namepoint, latitude, longitude FROM refuelingpoint")
-        depots = cur2.fetchall()
-
-        cur2.execute(
-            "SELECT section, latitude, longitude, azimuth "
-            "FROM locomotiveipadresses "
-            "WHERE dt >= NOW() - INTERVAL '10 minutes'"
-        )
-        locos = cur2.fetchall()
-    finally:
-        cur2.close()
+    # 4.1. Загружаем депо и новые (после watermark) позиции локомотивов
+    depots, changed = await run_db(load_depots_and_positions)
 
-    print(f"[TRACE] Loaded {len(depots)} depots and {len(locos)} locomotive records")
+    print(f"[TRACE] Loaded {len(depots)} depots, {len(feed.positions)} live sections, {len(changed)} moved")
 
-    for loco in locos:
-        section = loco['section']
-        lat_l = loco['latitude']
-        lon_l = loco['longitude']
-        azi_l = loco['azimuth']
+    approaching, nearby = feed.match(get_depot_index(depots))
+    print(f"[TRACE] Matched {len(approaching)} approaching and {len(nearby)} nearby pairs")
+
+    # Случай 1: 9–71 км и валидный азимут; случай 2: <10 км и азимут неизвестен
+    candidates = [(loco, depot, dist, False) for loco, depot, dist in approaching]
+    candidates += [(loco, depot, dist, True) for loco, depot, dist in nearby]
 
-        if None in (lat_l, lon_l):
-            print(f"[WARN] Skipping loco {section}: no coords")
+    # Проверяем кэш по ключу "test:section-depot_id"
+    pending = []
+    ttl = MESSAGE_TIMEOUT.total_seconds()
+    for loco, depot, dist, by_location in candidates:
+        key = notify_state_db.notification_key(NOTIFY_NAMESPACE, loco['section'], depot['id_point'])
+        if await run_db(notify_state_db.recently_sent, key, ttl):
+            print(f"[SKIP] Recent msg for {key}")
             continue
+        pending.append((key, loco, depot, dist, by_location))
 
-        for depot in depots:
-            depot_id   = depot['id_point']
-            depot_name = depot['namepoint']
-            lat_d      = depot['latitude']
-            lon_d      = depot['longitude']
-            if None in (lat_d, lon_d):
-                continue
-
-            dist = haversine(lat_l, lon_l, lat_d, lon_d)
-            print(f"[TRACE] Loco {section} → Depot {depot_name}: {dist:.1f} km")
-
-            # Проверяем кэш по ключу "section-depot_id"
-            key = f"{section}-{depot_id}"
-            now = datetime.utcnow()
-            last = last_sent_messages.get(key)
-            if last and now - last < MESSAGE_TIMEOUT:
-                print(f"[SKIP] Recent msg for {key}, {now-last} ago")
-                continue
-
-            # Определяем, нужно ли слать сообщение
-            msg = ''
-            # Случай 1: 9–71 км и валидный азимут
-            if 9 <= dist <= 71 and azi_l not in (None, -1):
-                brg = bearing(lat_l, lon_l, lat_d, lon_d)
-                diff = min((azi_l - brg) % 360, (brg - azi_l) % 360)
-                if diff <= 20:
-                    print(f"[INFO] Loco {section} approaching {depot_name}, diff={diff:.1f}°")
-                    msg = build_ticket_message(section, depot_name, dist)
-            # Случай 2: <10 км и азимут неизвестен
-            elif dist < 10 and azi_l == -1:
-                print(f"[INFO] Loco {section} within 10 km of {depot_name}, azimuth unknown")
-                msg = build_location_message(section, depot_name, dist, lat_l, lon_l)
-
-            if msg:
-                write_message(depot_name, msg)
-                last_sent_messages[key] = now
+    # 4.2. Заявки по всем секциям-кандидатам одним запросом
+    sections = {loco['section'] for _, loco, _, _, _ in pending}
+    tickets_by_section = await run_db(fetch_tickets, sections)
+    print(f"[TRACE] Fetched tickets for {len(tickets_by_section)} of {len(sections)} sections")
 
-# ──────────────────────────────────────────────────────────────────────────────
-# 6) Функции для работы с тикетами и формированием текста
+    for key, loco, depot, dist, by_location in pending:
+        section = loco['section']
+        depot_name = depot['namepoint']
+        tickets = tickets_by_section.get(section_key(section))
 
-def fetch_tickets(section):
-    cur1 = conn_helpdesk.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    try:
-        cur1.execute("""
-            SELECT id, created, description
-              FROM helpdesk_ticket
-             WHERE section_id = %s
-               AND created >= NOW() - INTERVAL '14 days'
-               AND status != 3
-             ORDER BY created DESC
-        """, (section,))
-        tickets = cur1.fetchall()
-        print(f"[TRACE] Fetched {len(tickets)} tickets for {section}")
-        return tickets
-    finally:
-        cur1.close()
+        if by_location:
+            print(f"[INFO] Loco {section} within 10 km of {depot_name}, azimuth unknown")
+            msg = build_location_message(section, depot_name, dist, loco['latitude'], loco['longitude'], tickets)
+        else:
+            print(f"[INFO] Loco {section} approaching {depot_name}, {dist:.1f} km")
+            msg = build_ticket_message(section, depot_name, dist, tickets)
+
+        if msg and await run_db(notify_state_db.claim, key, ttl):
+            write_message(depot_name, msg)
+
+# ──────────────────────────────────────────────────────────────────────────────
+# 5) Функции для работы с тикетами и формированием текста
 
 def format_ticket(t):
     ticket_id  = t['id']
@@ -159,8 +105,7 @@ def format_ticket(t):
         ""
     ]
 
-def build_ticket_message(section, depo, distance):
-    tickets = fetch_tickets(section)
+def build_ticket_message(section, depo, distance, tickets):
     if not tickets:
         return ''
     lines = [
@@ -173,8 +118,7 @@ def build_ticket_message(section, depo, distance):
         lines.extend(format_ticket(t))
     return "\n".join(lines)
 
-def build_location_message(section, depo, distance, lat, lon):
-    tickets = fetch_tickets(section)
+def build_location_message(section, depo, distance, lat, lon, tickets):
     if not tickets:
         return ''
     maps_url = f"https://www.google.com/maps?q={lat},{lon}&z=15"
@@ -200,7 +144,7 @@ def write_message(depo, message):
         f.write(message + "\n\n---\n\n")
 
 # ──────────────────────────────────────────────────────────────────────────────
-# 7) Запуск цикла
+# 6) Запуск цикла
 async def main():
     print("[START] Bot starting")
     try:
@@ -209,9 +153,8 @@ async def main():
             print("[SLEEP] Sleeping for 5 mins")
             await asyncio.sleep(5 * 60)
     finally:
-        # На выходе закрываем соединения
-        conn_helpdesk.close()
-        conn_loco.close()
+        # На выходе закрываем соединения пулов
+        close_pools()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -1,18 +1,35 @@
 import os
+from typing import List, Literal
 
-from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi import FastAPI, HTTPException, Header, Depends, Query
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, validator
-from bot import bot
-from database import settings_db
-from database.sqlite_db import check_user_by_phone, get_notifications_status, save_task
-from database.database import get_full_description
-from database.settings_db import get_domain
-import re
+from database import settings_db, outbox_db
+from database.sqlite_db import init_db, engine as sqlite_engine
+from database.database import pool_stats
+from bot import send_scheduler
+from task_delivery import deliver_task, deliver_tasks, extract_ttk_date_loco, resolve_recipient
+from outbox_worker import OutboxWorker
 
 settings_db.init_settings_db()
 
 API_KEY = os.getenv("API_KEY")
+# Upper bound on the number of items in one /send-tasks/ request
+SEND_TASKS_MAX_BATCH = int(os.getenv("SEND_TASKS_MAX_BATCH", "1000"))
 app = FastAPI()
+outbox_worker = OutboxWorker(deliver_task)
+
+@app.on_event("startup")
+async def start_outbox_worker():
+    # task_outbox is created by the sqlite_db migrations
+    await init_db()
+    outbox_worker.start()
+
+@app.on_event("shutdown")
+async def close_sqlite():
+    await outbox_worker.stop()
+    await send_scheduler.close()
+    await sqlite_engine.close()
 
 class TaskRequest(BaseModel):
     phone: str
@@ -32,46 +49,47 @@ def verify_api_key(x_api_key: str = Header(...)):
     if x_api_key != API_KEY:
         raise HTTPException(status_code=403, detail="Недействительный API ключ.")
 
-def extract_ttk_date_loco(message: str):
-    ttk_match = re.search(r'ТТК (\d+)', message)
-    date_match = re.search(r'(\d{4})-(\d{2})-(\d{2})', message)
-    loco_match = re.search(r'\d{2}:\d{2} (.+)', message)
-    if ttk_match and date_match and loco_match:
-        ttk_number = int(ttk_match.group(1))
-        year, month, day = date_match.groups()
-        loco_number = loco_match.group(1).strip()
-        month_day = f"{month}-{day}"
-        return ttk_number, year, month_day, loco_number
-    raise HTTPException(status_code=400, detail="Не удалось извлечь номер TTK, год, месяц, день или номер локомотива из сообщения.")
-
 
 @app.post("/send-task/", dependencies=[Depends(verify_api_key)])
-async def send_task(data: TaskRequest):
+async def send_task(data: TaskRequest, mode: Literal["sync", "async"] = Query("sync")):
     print("Received data:", data.dict())
 
-    ttk_number, year, month_day, loco_number = extract_ttk_date_loco(data.body)
-    ticket_id, full_description = await get_full_description(ttk_number, year)
-    user = await check_user_by_phone(data.phone)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь с указанным номером не найден.")
-    telegram_id = user[2]
-    notifications_enabled = await get_notifications_status(telegram_id)
-    if not notifications_enabled:
-        raise HTTPException(status_code=403, detail="Пользователь отключил получение заданий.")
-
-    base = get_domain()
-    if not base:
-        raise HTTPException(status_code=500, detail="Домен не задан в настройках.")
-    url = f"{base}{ticket_id}/"
-    message_text = (
-        f"📋 {full_description}\n\n"
-        f"<a href=\"{url}\">Ссылка на заявку #{ticket_id}</a>"
-    )
-    await bot.send_message(
-        chat_id=telegram_id,
-        text=message_text,
-        parse_mode="HTML",
-        disable_web_page_preview=True
-    )
-    await save_task(telegram_id, ttk_number, message_text, month_day, loco_number)
+    if mode == "async":
+        # Cheap checks up front; the Postgres lookup and the Telegram call happen in the worker
+        extract_ttk_date_loco(data.body)
+        await resolve_recipient(data.phone)
+        job_id = await outbox_db.enqueue(data.phone, data.body)
+        outbox_worker.notify()
+        return JSONResponse(
+            status_code=202,
+            content={"status": "Задание принято в очередь.", "job_id": job_id}
+        )
+
+    await deliver_task(data.phone, data.body)
     return {"status": "Задание успешно отправлено."}
+
+
+@app.post("/send-tasks/", dependencies=[Depends(verify_api_key)])
+async def send_tasks(data: List[TaskRequest]):
+    # Results are returned in request order: {"status": 200 | 4xx | 5xx, "detail": ...}
+    print("Received batch:", len(data))
+    if len(data) > SEND_TASKS_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Не больше {SEND_TASKS_MAX_BATCH} заданий за один запрос.")
+    results = await deliver_tasks([(item.phone, item.body) for item in data])
+    return {
+        "sent": sum(1 for r in results if r["status"] == 200),
+        "results": results
+    }
+
+
+@app.get("/send-task/{job_id}", dependencies=[Depends(verify_api_key)])
+async def get_task_status(job_id: int):
+    job = await outbox_db.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено.")
+    return job
+
+
+@app.get("/pool-stats/", dependencies=[Depends(verify_api_key)])
+async def get_pool_stats():
+    return pool_stats()
@@ -1,16 +1,13 @@
 import asyncio
-import io
 import logging
 import tempfile
 from functools import wraps
-import aiosqlite
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
-from aiogram.types.input_file import FSInputFile, BufferedInputFile
+from aiogram.types.input_file import FSInputFile
 from dotenv import load_dotenv
 import os
 from database.sqlite_db import (
@@ -19,11 +16,18 @@ from database.sqlite_db import (
     init_db,
     update_notifications_status,
     get_notifications_status,
-    DB,
-    check_user_active
+    get_task_buttons,
+    get_task_description,
+    engine as sqlite_engine
 )
+from database.auth_cache import auth_cache
+from database.fsm_storage import SQLiteStorage
+from database.async_db import run_db
 from database.database import check_phone_in_postgres
 from additional import CSVcorrector
+from additional.csv_rules import RULES, DEFAULT_RULE
+from main.send_scheduler import SendScheduler
+from main.csv_jobs import CSVJobQueue, CSVJobRejected
 
 if not os.path.exists("../downloads"):
     os.makedirs("../downloads")
@@ -32,8 +36,14 @@ load_dotenv()
 
 API_TOKEN = os.getenv("TG_API_KEY")
 bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+# All chat-addressed requests of this bot are rate limited by one scheduler,
+# whose global bucket every process importing this module shares through users.db
+send_scheduler = SendScheduler(sqlite_engine)
+bot.session.middleware(send_scheduler)
+# Conversation state survives restarts and is shared through users.db
+storage = SQLiteStorage(sqlite_engine)
 dp = Dispatcher(storage=storage)
+csv_jobs = CSVJobQueue()
 
 
 class UserDataState(StatesGroup):
@@ -45,6 +55,7 @@ class UploadCSV(StatesGroup):
 
 
 class CSVCorrection(StatesGroup):
+    choosing_rule = State()
     waiting_for_file = State()
 
 
@@ -63,12 +74,10 @@ def check_user_active_decorator(handler):
     @wraps(handler)
     async def wrapper(message: types.Message, *args, **kwargs):
         telegram_id = message.from_user.id
-        user = await check_user_by_telegram_id(telegram_id)
-        if not user:
+        phone, is_active = await auth_cache.lookup(telegram_id)
+        if not phone:
             await message.answer("Ваш аккаунт не найден.")
             return
-        phone = user[1]
-        is_active = await check_user_active(phone)
         if not is_active:
             await message.answer("Вы не активны.")
             return
@@ -76,18 +85,34 @@ def check_user_active_decorator(handler):
     return wrapper
 
 
-async def process_csv_file(file_path: str) -> str:
-    loop = asyncio.get_running_loop()
-    processed_content = await loop.run_in_executor(None, process_csv_sync, file_path)
-    with tempfile.NamedTemporaryFile(delete=False, suffix='_corrected.csv', mode='w', encoding='utf-8') as tmp:
-        tmp.write(processed_content)
-        return tmp.name
+def csv_progress_reporter(message: types.Message):
+    # First call sends a progress message, later calls edit it
+    progress = None
+
+    async def report(percent: int):
+        nonlocal progress
+        text = f"⏳ Файл обрабатывается: {percent}%"
+        try:
+            if progress is None:
+                progress = await message.answer(text)
+            else:
+                await progress.edit_text(text)
+        except Exception as e:
+            logging.warning(f"Не удалось обновить прогресс обработки: {e}")
+
+    return report
 
 
-def process_csv_sync(file_path: str) -> str:
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    return CSVcorrector.process_csv(content)
+async def process_csv_file(message: types.Message, file_path: str, rule_name: str = DEFAULT_RULE) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix='_corrected.csv') as tmp:
+        processed_file_path = tmp.name
+    try:
+        await csv_jobs.run(CSVcorrector.correct_file, file_path, processed_file_path, rule_name,
+                           report=csv_progress_reporter(message))
+    except BaseException:
+        os.remove(processed_file_path)
+        raise
+    return processed_file_path
 
 
 @dp.message(Command("start"))
@@ -107,11 +132,11 @@ async def start_handler(message: types.Message):
 @dp.message(lambda message: message.contact is not None)
 async def process_contact(message: types.Message):
     phone = f"+{message.contact.phone_number.lstrip('+')}"
-    loop = asyncio.get_running_loop()
-    user_data = await loop.run_in_executor(None, lambda: check_phone_in_postgres(phone))
+    user_data = await run_db(check_phone_in_postgres, phone)
     if user_data:
         telegram_id = message.from_user.id
         await add_user(phone, telegram_id)
+        auth_cache.invalidate(telegram_id)
         await message.answer("Ваш номер зарегистрирован!", reply_markup=get_main_keyboard(True))
     else:
         await message.answer("Ваш номер отсутствует в базе данных.")
@@ -132,28 +157,23 @@ async def toggle_notifications(message: types.Message):
 @check_user_active_decorator
 async def show_tasks(message: types.Message):
     telegram_id = message.from_user.id
-    async with aiosqlite.connect(DB) as db:
-        cursor = await db.execute(
-            "SELECT ttk_number, month_day, loco_number FROM user_tasks WHERE telegram_id = ? ORDER BY id DESC LIMIT 5",
-            (telegram_id,)
-        )
-        tasks = await cursor.fetchall()
-        if tasks:
-            task_buttons = [
-                [KeyboardButton(text=f"заявка: {task[0]}, {task[1]}, {task[2]}")]
-                for task in tasks
-            ]
-            task_buttons.append([KeyboardButton(text="Назад"), KeyboardButton(text="Обновить")])
-            task_keyboard = ReplyKeyboardMarkup(keyboard=task_buttons, resize_keyboard=True)
-            await message.answer("Ваши заявки:", reply_markup=task_keyboard)
-        else:
-            await message.answer(
-                "У вас нет назначенных заявок.",
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[[KeyboardButton(text="Назад"), KeyboardButton(text="Обновить")]],
-                    resize_keyboard=True
-                )
+    tasks = await get_task_buttons(telegram_id)
+    if tasks:
+        task_buttons = [
+            [KeyboardButton(text=f"заявка: {task[0]}, {task[1]}, {task[2]}")]
+            for task in tasks
+        ]
+        task_buttons.append([KeyboardButton(text="Назад"), KeyboardButton(text="Обновить")])
+        task_keyboard = ReplyKeyboardMarkup(keyboard=task_buttons, resize_keyboard=True)
+        await message.answer("Ваши заявки:", reply_markup=task_keyboard)
+    else:
+        await message.answer(
+            "У вас нет назначенных заявок.",
+            reply_markup=ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text="Назад"), KeyboardButton(text="Обновить")]],
+                resize_keyboard=True
             )
+        )
 
 
 @dp.message(lambda message: message.text == "Обновить")
@@ -171,17 +191,10 @@ async def send_task_description(message: types.Message):
         return
 
     telegram_id = message.from_user.id
-    async with aiosqlite.connect(DB) as db:
-        cursor = await db.execute(
-            "SELECT description FROM user_tasks WHERE telegram_id = ? AND ttk_number = ?",
-            (telegram_id, ttk_number)
-        )
-        row = await cursor.fetchone()
-
-    if not row:
+    description_with_link = await get_task_description(telegram_id, ttk_number)
+    if description_with_link is None:
         await message.answer("Заявка не найдена или описание отсутствует.")
         return
-    description_with_link = row[0]
     await message.answer(
         f"📋 Описание заявки {ttk_number}:\n\n{description_with_link}",
         parse_mode="HTML",
@@ -192,7 +205,9 @@ async def send_task_description(message: types.Message):
 
 @dp.message(lambda message: message.text == "Назад")
 @check_user_active_decorator
-async def go_back(message: types.Message):
+async def go_back(message: types.Message, state: FSMContext):
+    # Also leaves any flow that offered "Назад", e.g. choosing the CSV format
+    await state.clear()
     notifications_enabled = await get_notifications_status(message.from_user.id)
     await message.answer("Главное меню:", reply_markup=get_main_keyboard(notifications_enabled))
 
@@ -216,11 +231,13 @@ async def handle_file(message: types.Message, state: FSMContext):
         return
     file_path = f"downloads/{document.file_name}"
     try:
-        file_info = await bot.get_file(document.file_id)
-        file_bytes = await bot.download_file(file_info.file_path)
-        with open(file_path, 'wb') as f:
-            f.write(file_bytes)
-        processed_file_path = await process_csv_file(file_path)
+        with csv_jobs.slot(message.from_user.id):
+            file_info = await bot.get_file(document.file_id)
+            await bot.download_file(file_info.file_path, destination=file_path)
+            processed_file_path = await process_csv_file(message, file_path)
+    except CSVJobRejected as e:
+        await message.answer(str(e))
+        return
     except Exception as e:
         logging.error(f"Ошибка при сохранении файла: {e}")
         await message.answer("Произошла ошибка при обработке файла. Попробуйте снова.")
@@ -246,12 +263,39 @@ async def handle_file(message: types.Message, state: FSMContext):
 
 
 
+def get_rules_keyboard():
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=rule.title)] for rule in RULES.values()] + [[KeyboardButton(text="Назад")]],
+        resize_keyboard=True
+    )
+
+
 @dp.message(lambda message: message.text == "⚙️ Корректировать CSV")
 async def request_csv_correction(message: types.Message, state: FSMContext):
+    if len(RULES) > 1:
+        await message.answer("Выберите формат выгрузки:", reply_markup=get_rules_keyboard())
+        await state.set_state(CSVCorrection.choosing_rule)
+        return
+    await state.update_data(csv_rule=DEFAULT_RULE)
     await message.answer("Пожалуйста, отправьте CSV-файл для корректировки.")
     await state.set_state(CSVCorrection.waiting_for_file)
 
 
+@dp.message(CSVCorrection.choosing_rule)
+async def choose_csv_rule(message: types.Message, state: FSMContext):
+    rule = next((rule for rule in RULES.values() if rule.title == message.text), None)
+    if rule is None:
+        await message.answer("Выберите формат выгрузки кнопкой ниже.", reply_markup=get_rules_keyboard())
+        return
+    await state.update_data(csv_rule=rule.name)
+    notifications_enabled = await get_notifications_status(message.from_user.id)
+    await message.answer(
+        f"Формат «{rule.title}». Пожалуйста, отправьте CSV-файл для корректировки.",
+        reply_markup=get_main_keyboard(notifications_enabled)
+    )
+    await state.set_state(CSVCorrection.waiting_for_file)
+
+
 async def csv_correction_filter(message: types.Message, state: FSMContext):
     current_state = await state.get_state()
     return current_state == CSVCorrection.waiting_for_file and message.document is not None
@@ -263,26 +307,42 @@ async def handle_csv_correction(message: types.Message, state: FSMContext):
     if not document.file_name.endswith('.csv'):
         await message.answer("Пожалуйста, отправьте файл в формате CSV.")
         return
+    rule_name = (await state.get_data()).get("csv_rule", DEFAULT_RULE)
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp:
+        file_path = tmp.name
+    processed_file_path = None
     try:
-        file_info = await bot.get_file(document.file_id)
-        file_obj = await bot.download_file(file_info.file_path)
-        if isinstance(file_obj, io.BytesIO):
-            file_content = file_obj.getvalue().decode('utf-8')
-        else:
-            file_content = file_obj.decode('utf-8')
-        processed_content = CSVcorrector.process_csv(file_content)
-        processed_file = io.BytesIO(processed_content.encode('utf-8'))
-        input_file = BufferedInputFile(processed_file.getvalue(), filename=document.file_name.replace('.csv', '_corrected.csv'))
+        with csv_jobs.slot(message.from_user.id):
+            file_info = await bot.get_file(document.file_id)
+            await bot.download_file(file_info.file_path, destination=file_path)
+            processed_file_path = await process_csv_file(message, file_path, rule_name)
+        input_file = FSInputFile(processed_file_path, filename=document.file_name.replace('.csv', '_corrected.csv'))
         await message.answer_document(input_file, caption="⚙️ Вот ваш обработанный файл!")
+    except CSVJobRejected as e:
+        await message.answer(str(e))
+        return
     except Exception as e:
         await message.answer(f"Произошла ошибка при обработке файла: {e}")
+    finally:
+        for path in (file_path, processed_file_path):
+            if path and os.path.exists(path):
+                os.remove(path)
     await state.clear()
 
 
 async def main():
     await init_db()
+    try:
+        await auth_cache.warm()
+    except Exception as e:
+        logging.error(f"Не удалось загрузить активных сотрудников: {e}")
     print("Бот запущен...")
-    await dp.start_polling(bot, skip_updates=True)
+    try:
+        await dp.start_polling(bot, skip_updates=True)
+    finally:
+        csv_jobs.shutdown()
+        await storage.close()
+        await sqlite_engine.close()
 
 
 if __name__ == "__main__":
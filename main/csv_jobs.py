@@ -0,0 +1,85 @@
+import asyncio
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# CSV corrections are CPU-bound and run in worker processes, not on the bot's event loop
+CSV_WORKERS = int(os.getenv("CSV_WORKERS", str(os.cpu_count() or 2)))
+# Jobs running or waiting for a worker; further uploads are turned away
+CSV_QUEUE_DEPTH = int(os.getenv("CSV_QUEUE_DEPTH", str(4 * CSV_WORKERS)))
+CSV_JOBS_PER_USER = int(os.getenv("CSV_JOBS_PER_USER", "1"))
+# A job running longer than this gets a progress message, updated every interval
+CSV_PROGRESS_DELAY = float(os.getenv("CSV_PROGRESS_DELAY", "5"))
+CSV_PROGRESS_INTERVAL = float(os.getenv("CSV_PROGRESS_INTERVAL", "5"))
+
+
+class CSVJobRejected(Exception):
+    # The message is shown to the user as is
+    pass
+
+
+class CSVJobQueue:
+    """
+    Bounded queue of file-to-file CSV jobs on a process pool.
+
+    slot(user_id) admits a job or raises CSVJobRejected when the user already has
+    `per_user` jobs or the queue holds `queue_depth` of them; run() executes the
+    job in a worker process and reports progress for long jobs, estimated from
+    the size of the output file against the input.
+    """
+
+    def __init__(self, workers: int = CSV_WORKERS, queue_depth: int = CSV_QUEUE_DEPTH,
+                 per_user: int = CSV_JOBS_PER_USER):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.per_user = per_user
+        self._executor = None
+        self._pending = 0
+        self._by_user = {}
+
+    @contextlib.contextmanager
+    def slot(self, user_id):
+        if self._by_user.get(user_id, 0) >= self.per_user:
+            raise CSVJobRejected("Ваш предыдущий файл ещё обрабатывается, дождитесь результата.")
+        if self._pending >= self.queue_depth:
+            raise CSVJobRejected("Сейчас обрабатывается слишком много файлов, попробуйте позже.")
+        self._pending += 1
+        self._by_user[user_id] = self._by_user.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._pending -= 1
+            if self._by_user[user_id] <= 1:
+                del self._by_user[user_id]
+            else:
+                self._by_user[user_id] -= 1
+
+    async def run(self, fn, src_path: str, dst_path: str, *args, report=None):
+        # Runs fn(src_path, dst_path, *args) in the pool; report(percent) is awaited for long jobs
+        if self._executor is None:
+            # Workers are started fresh rather than forked from the bot process with its loop and connections
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(self._executor, fn, src_path, dst_path, *args)
+        if report is None:
+            return await job
+
+        total = max(os.path.getsize(src_path), 1)
+        timeout = CSV_PROGRESS_DELAY
+        while True:
+            done, _ = await asyncio.wait({job}, timeout=timeout)
+            if done:
+                return job.result()
+            try:
+                written = os.path.getsize(dst_path)
+            except OSError:
+                written = 0
+            await report(min(99, written * 100 // total))
+            timeout = CSV_PROGRESS_INTERVAL
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,135 @@
+import asyncio
+import os
+
+from main.send_scheduler import BULK
+
+# Seconds a chat's first notification waits for more to merge with it
+COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", "3"))
+# Telegram rejects messages longer than 4096 UTF-16 code units
+MESSAGE_LIMIT = 4096
+SEPARATOR = "\n\n"
+
+
+def message_length(text: str):
+    # Telegram counts UTF-16 code units, emoji take two
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _cut(line: str, limit: int):
+    # Pieces of one line, each at most `limit` UTF-16 code units
+    piece, length = [], 0
+    for char in line:
+        units = 2 if ord(char) > 0xFFFF else 1
+        if length + units > limit:
+            yield "".join(piece)
+            piece, length = [], 0
+        piece.append(char)
+        length += units
+    yield "".join(piece)
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT):
+    # Splits a text into messages of at most `limit` UTF-16 code units, between
+    # lines where possible; only a single overlong line is cut inside
+    chunks, lines, length = [], [], 0
+    for line in text.split("\n"):
+        pieces = list(_cut(line, limit)) if message_length(line) > limit else [line]
+        for piece in pieces:
+            piece_length = message_length(piece)
+            if lines and length + 1 + piece_length > limit:
+                chunks.append("\n".join(lines))
+                lines, length = [], 0
+            length += piece_length + (1 if lines else 0)
+            lines.append(piece)
+    chunks.append("\n".join(lines))
+    # Telegram rejects empty messages, a split can leave chunks of blank lines
+    return [chunk for chunk in chunks if chunk.strip()] or [text]
+
+
+class _Batch:
+    __slots__ = ("chat_id", "priority", "kwargs", "parts", "length", "future", "timer")
+
+    def __init__(self, chat_id, priority, kwargs):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.kwargs = kwargs
+        self.parts = []
+        self.length = 0
+        self.future = asyncio.get_running_loop().create_future()
+        self.timer = None
+
+
+class NotificationCoalescer:
+    """
+    Buffers notifications per chat for `window` seconds and sends them through the
+    send scheduler as few messages as the 4096-character limit allows. A batch is
+    flushed when its window expires or when the next text would not fit.
+
+    Only texts with the same priority and send options (parse_mode, ...) are merged.
+    A text longer than the limit is split between lines into several messages.
+    send() returns once the messages carrying the text are delivered, so callers
+    that submit concurrently share one Telegram request per chat.
+    """
+
+    def __init__(self, scheduler, bot, window: float = COALESCE_WINDOW, max_length: int = MESSAGE_LIMIT,
+                 separator: str = SEPARATOR):
+        self.scheduler = scheduler
+        self.bot = bot
+        self.window = window
+        self.max_length = max_length
+        self.separator = separator
+        self._separator_length = message_length(separator)
+        self._batches = {}  # (chat_id, priority, options) -> _Batch
+        self._in_flight = set()
+
+    async def send(self, chat_id, text, priority=BULK, **kwargs):
+        key = (chat_id, priority, tuple(sorted(kwargs.items())))
+        chunks = [text] if message_length(text) <= self.max_length else split_message(text, self.max_length)
+        # Chunks join the chat's batches in order, so they are also delivered in order
+        futures = [self._add(key, chat_id, chunk, priority, kwargs) for chunk in chunks]
+        # One cancelled caller must not cancel the delivery for the rest of the batch
+        return (await asyncio.shield(asyncio.gather(*futures)))[-1]
+
+    def _add(self, key, chat_id, text, priority, kwargs):
+        # Appends the text to the chat's batch; returns the future of the message carrying it
+        length = message_length(text)
+        batch = self._batches.get(key)
+        if batch is not None and batch.length + self._separator_length + length > self.max_length:
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = self._batches[key] = _Batch(chat_id, priority, kwargs)
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        else:
+            length += self._separator_length
+        batch.parts.append(text)
+        batch.length += length
+        future = batch.future
+        if batch.length >= self.max_length:
+            self._flush(key)
+        return future
+
+    def _flush(self, key):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.create_task(self._deliver(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _deliver(self, batch):
+        try:
+            result = await self.scheduler.send_message(
+                self.bot, batch.chat_id, self.separator.join(batch.parts), priority=batch.priority, **batch.kwargs
+            )
+        except Exception as e:
+            batch.future.set_exception(e)
+        else:
+            batch.future.set_result(result)
+
+    async def flush(self):
+        # Sends everything buffered now and waits for it, e.g. before shutdown
+        for key in list(self._batches):
+            self._flush(key)
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from fastapi import HTTPException
+
+from database import outbox_db
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+# Upper bound on sleeping between outbox checks when nothing wakes the worker
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+PURGE_INTERVAL = 3600  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+def backoff(attempts: int):
+    # Exponential with full jitter: attempt 1 waits up to BASE, attempt 2 up to 2*BASE, ...
+    return random.uniform(0, min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1)))
+
+
+def classify(error: Exception):
+    # -> (retry, delay or None). Request errors (4xx) and rejected messages are final.
+    if isinstance(error, TelegramRetryAfter):
+        return True, float(error.retry_after)
+    if isinstance(error, (TelegramForbiddenError, TelegramBadRequest)):
+        return False, None
+    if isinstance(error, HTTPException):
+        return error.status_code >= 500, None
+    return True, None
+
+
+def describe(error: Exception):
+    if isinstance(error, HTTPException):
+        return f"{error.status_code}: {error.detail}"
+    return f"{type(error).__name__}: {error}"
+
+
+class OutboxWorker:
+    # Drains task_outbox with `workers` concurrent deliveries. One fetcher claims
+    # only as many due jobs as there are idle workers, so a claimed job starts at
+    # once; its lease is renewed while it runs. notify() wakes the fetcher right
+    # after a new job is enqueued.
+
+    def __init__(self, deliver, workers: int = OUTBOX_WORKERS, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL, lease: float = outbox_db.OUTBOX_LEASE):
+        self.deliver = deliver
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._idle = None
+        self._wakeup = None
+        self._fetcher = None
+        self._jobs = set()
+
+    def start(self):
+        if self._fetcher is not None:
+            return
+        self._idle = asyncio.Semaphore(self.workers)
+        self._wakeup = asyncio.Event()
+        self._fetcher = asyncio.create_task(self._fetch_loop())
+
+    async def stop(self):
+        # Jobs claimed but not delivered are retried after their lease expires
+        tasks = [self._fetcher, *self._jobs] if self._fetcher is not None else []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._fetcher = None
+        self._jobs.clear()
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _sleep(self):
+        timeout = self.poll_interval
+        try:
+            due = await outbox_db.next_due_at()
+        except Exception:
+            logger.exception("Ошибка чтения outbox")
+            due = None
+        if due is not None:
+            timeout = max(0.0, min(timeout, due - time.time()))
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _fetch_loop(self):
+        last_purge = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            if loop.time() - last_purge >= PURGE_INTERVAL:
+                last_purge = loop.time()
+                try:
+                    await outbox_db.purge_finished()
+                except Exception:
+                    logger.exception("Ошибка очистки outbox")
+            # Wait for one idle worker, then take every other one that is idle now
+            await self._idle.acquire()
+            idle = 1
+            while idle < self.workers and not self._idle.locked():
+                await self._idle.acquire()
+                idle += 1
+            try:
+                jobs = await outbox_db.claim_due(idle, self.lease)
+            except Exception:
+                logger.exception("Ошибка чтения outbox")
+                jobs = []
+            for job in jobs:
+                task = asyncio.create_task(self._work(job))
+                self._jobs.add(task)
+                task.add_done_callback(self._jobs.discard)
+            for _ in range(idle - len(jobs)):
+                self._idle.release()
+            if not jobs:
+                await self._sleep()
+
+    async def _work(self, job):
+        job_id = job[0]
+        try:
+            await self._run(*job)
+        except Exception:
+            logger.exception("Ошибка обработки задания %s из outbox", job_id)
+        finally:
+            self._idle.release()
+
+    async def _renew_lease(self, job_id, token):
+        # Keeps the claim alive while a delivery waits on throttling or RetryAfter
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not await outbox_db.renew_lease(job_id, token, self.lease):
+                logger.warning("Задание %s: аренда перехвачена другим обработчиком", job_id)
+                return
+
+    async def _run(self, job_id, phone, body, attempts, token):
+        renewal = asyncio.create_task(self._renew_lease(job_id, token))
+        try:
+            await self.deliver(phone, body)
+        except Exception as e:
+            retry, delay = classify(e)
+            error = describe(e)
+            if retry and attempts < self.max_attempts:
+                delay = backoff(attempts) if delay is None else delay
+                logger.warning("Задание %s: попытка %s не удалась (%s), повтор через %.1f с",
+                               job_id, attempts, error, delay)
+                await outbox_db.mark_retry(job_id, token, error, delay)
+            else:
+                logger.error("Задание %s не доставлено: %s", job_id, error)
+                await outbox_db.mark_failed(job_id, token, error)
+            return
+        finally:
+            renewal.cancel()
+        if not await outbox_db.mark_sent(job_id, token):
+            logger.warning("Задание %s отправлено, но его аренда уже перехвачена", job_id)
@@ -0,0 +1,228 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from database.send_rate_db import SharedRateLimit
+
+# Telegram allows about 30 messages per second per bot and 1 per second per chat.
+# The global rate is shared by every process sending with the bot token.
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+GLOBAL_BURST = float(os.getenv("TG_GLOBAL_BURST", "25"))
+CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+SEND_CONCURRENCY = int(os.getenv("TG_SEND_CONCURRENCY", "16"))
+# How many times a request is put back after a 429 before the error is raised
+MAX_RETRY_AFTER = int(os.getenv("TG_MAX_RETRY_AFTER", "5"))
+IDLE_CHAT_TTL = 600  # seconds without sends before a chat's bucket is forgotten
+
+# Priority lanes, lower is served first
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+
+_priority = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now=None):
+        # Takes a token, possibly going into debt; returns when it may be used
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+        return now if self.tokens >= 0 else now - self.tokens / self.rate
+
+    def pause(self, seconds: float):
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class _Request:
+    __slots__ = ("priority", "seq", "chat_id", "make_request", "bot", "method", "future", "ready_at", "retries")
+
+    def __init__(self, priority, seq, chat_id, make_request, bot, method):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.future = asyncio.get_running_loop().create_future()
+        self.ready_at = None  # set once the per-chat slot is reserved
+        self.retries = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Request middleware for the bot session: every Telegram method addressed to a
+    chat goes through a global and a per-chat token bucket before it is sent.
+    Waiting requests are served by priority lane (INTERACTIVE, NORMAL, BULK),
+    up to `concurrency` are in flight at once, and a 429 RetryAfter pauses
+    sending for the time Telegram asks and puts the request back.
+
+    The global bucket and the lane ordering live in users.db (SharedRateLimit),
+    so the bot, monitor, tracker and API processes stay within one bot limit
+    together. Per-chat buckets are kept by each process.
+
+    Calls without an explicit lane (bot handlers answering a user) are
+    INTERACTIVE; background senders use send_message(..., priority=BULK).
+    """
+
+    def __init__(self, engine, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, concurrency=SEND_CONCURRENCY):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.concurrency = concurrency
+        self._global = SharedRateLimit(engine, global_rate, global_burst)
+        self._chats = {}  # chat_id -> TokenBucket
+        self._ready = []  # heap of _Request by (priority, seq)
+        self._delayed = []  # heap of (ready_at, seq, _Request) waiting for their chat slot
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._slots = None
+        self._task = None
+        self._in_flight = set()
+        self._last_cleanup = time.monotonic()
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, getFile, answerCallbackQuery, ... are not rate limited here
+            return await make_request(bot, method)
+        self._ensure_started()
+        request = _Request(_priority.get(), next(self._seq), chat_id, make_request, bot, method)
+        heapq.heappush(self._ready, request)
+        self._wakeup.set()
+        return await request.future
+
+    async def send_message(self, bot, chat_id, text, priority=NORMAL, **kwargs):
+        token = _priority.set(priority)
+        try:
+            return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        finally:
+            _priority.reset(token)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.create_task(self._dispatch_loop())
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _cleanup(self, now):
+        if now - self._last_cleanup < IDLE_CHAT_TTL:
+            return
+        self._last_cleanup = now
+        for chat_id in [c for c, b in self._chats.items() if now - b.updated > IDLE_CHAT_TTL]:
+            del self._chats[chat_id]
+
+    def _promote(self, now):
+        while self._delayed and self._delayed[0][0] <= now:
+            heapq.heappush(self._ready, heapq.heappop(self._delayed)[2])
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch_loop(self):
+        while True:
+            now = time.monotonic()
+            self._promote(now)
+            self._cleanup(now)
+            if not self._ready:
+                await self._wait(self._delayed[0][0] - now if self._delayed else None)
+                continue
+
+            request = heapq.heappop(self._ready)
+            if request.future.done():
+                continue
+            if request.ready_at is None:
+                # Per-chat slots are reserved in arrival order, so one chat's
+                # messages keep their order even when they have to wait.
+                request.ready_at = self._chat_bucket(request.chat_id).reserve(now)
+                if request.ready_at > now:
+                    heapq.heappush(self._delayed, (request.ready_at, request.seq, request))
+                    continue
+
+            waiting = self._ready[0].priority if self._ready else None
+            try:
+                delay = await self._global.acquire(request.priority, waiting)
+            except Exception as e:
+                logger.error("Не удалось получить слот отправки: %s", e)
+                delay = 1 / self._global.rate
+            if delay:
+                # Re-check the lanes after the wait, a more urgent request may
+                # have arrived meanwhile.
+                heapq.heappush(self._ready, request)
+                await self._wait(delay)
+                continue
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(request))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, request):
+        try:
+            result = await request.make_request(request.bot, request.method)
+        except TelegramRetryAfter as e:
+            if request.retries >= MAX_RETRY_AFTER:
+                if not request.future.done():
+                    request.future.set_exception(e)
+                return
+            logger.warning("Telegram RetryAfter %s с для чата %s", e.retry_after, request.chat_id)
+            request.retries += 1
+            try:
+                await self._global.pause(e.retry_after)
+            except Exception as pause_error:
+                logger.error("Не удалось приостановить отправку: %s", pause_error)
+            self._chat_bucket(request.chat_id).pause(e.retry_after)
+            request.ready_at = time.monotonic() + e.retry_after
+            heapq.heappush(self._delayed, (request.ready_at, request.seq, request))
+            self._wakeup.set()
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self._global.leave()
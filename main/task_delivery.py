@@ -0,0 +1,125 @@
+import asyncio
+import os
+import re
+
+from fastapi import HTTPException
+from bot import bot, send_scheduler
+from main.send_scheduler import NORMAL
+from database.sqlite_db import check_user_by_phone, get_notifications_status, get_users_by_phones, save_task
+from database.database import get_full_description, get_full_descriptions
+from database.settings_db import get_domain_async
+
+# Parallel Telegram sends for one /send-tasks/ batch
+SEND_TASKS_CONCURRENCY = int(os.getenv("SEND_TASKS_CONCURRENCY", "10"))
+
+
+def extract_ttk_date_loco(message: str):
+    ttk_match = re.search(r'ТТК (\d+)', message)
+    date_match = re.search(r'(\d{4})-(\d{2})-(\d{2})', message)
+    loco_match = re.search(r'\d{2}:\d{2} (.+)', message)
+    if ttk_match and date_match and loco_match:
+        ttk_number = int(ttk_match.group(1))
+        year, month, day = date_match.groups()
+        loco_number = loco_match.group(1).strip()
+        month_day = f"{month}-{day}"
+        return ttk_number, year, month_day, loco_number
+    raise HTTPException(status_code=400, detail="Не удалось извлечь номер TTK, год, месяц, день или номер локомотива из сообщения.")
+
+
+async def resolve_recipient(phone: str):
+    # telegram_id of a registered user who accepts tasks
+    user = await check_user_by_phone(phone)
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь с указанным номером не найден.")
+    telegram_id = user[2]
+    notifications_enabled = await get_notifications_status(telegram_id)
+    if not notifications_enabled:
+        raise HTTPException(status_code=403, detail="Пользователь отключил получение заданий.")
+    return telegram_id
+
+
+def build_task_message(base: str, ticket_id, full_description: str):
+    url = f"{base}{ticket_id}/"
+    return (
+        f"📋 {full_description}\n\n"
+        f"<a href=\"{url}\">Ссылка на заявку #{ticket_id}</a>"
+    )
+
+
+async def send_and_save(telegram_id: int, message_text: str, ttk_number, month_day: str, loco_number: str):
+    await send_scheduler.send_message(
+        bot,
+        telegram_id,
+        message_text,
+        priority=NORMAL,
+        parse_mode="HTML",
+        disable_web_page_preview=True
+    )
+    await save_task(telegram_id, ttk_number, message_text, month_day, loco_number)
+
+
+async def get_base_domain():
+    base = await get_domain_async()
+    if not base:
+        raise HTTPException(status_code=500, detail="Домен не задан в настройках.")
+    return base
+
+
+async def deliver_task(phone: str, body: str):
+    # Parse, look up the ticket and the user, send to Telegram and store the task.
+    # Used by /send-task/ directly and by the outbox worker.
+    ttk_number, year, month_day, loco_number = extract_ttk_date_loco(body)
+    ticket_id, full_description = await get_full_description(ttk_number, year)
+    telegram_id = await resolve_recipient(phone)
+    message_text = build_task_message(await get_base_domain(), ticket_id, full_description)
+    await send_and_save(telegram_id, message_text, ttk_number, month_day, loco_number)
+
+
+def _error(status_code: int, detail: str):
+    return {"status": status_code, "detail": detail}
+
+
+async def deliver_tasks(items, concurrency: int = SEND_TASKS_CONCURRENCY):
+    # Batch version of deliver_task for [(phone, body), ...]: one lookup for all
+    # TTK descriptions, one for all users, then at most `concurrency` sends at a time.
+    # Returns a result per item in input order; one failed item does not stop the rest.
+    results = [None] * len(items)
+    parsed = {}
+    for i, (phone, body) in enumerate(items):
+        try:
+            parsed[i] = extract_ttk_date_loco(body)
+        except HTTPException as e:
+            results[i] = _error(e.status_code, e.detail)
+    if not parsed:
+        return results
+
+    base = await get_base_domain()
+    descriptions = await get_full_descriptions((ttk, year) for ttk, year, _, _ in parsed.values())
+    users = await get_users_by_phones(items[i][0] for i in parsed)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver(i, ttk_number, year, month_day, loco_number):
+        description = descriptions.get((str(ttk_number), int(year)))
+        if description is None:
+            results[i] = _error(404, f"Description for TTK {ttk_number} in year {year} not found.")
+            return
+        user = users.get(items[i][0])
+        if user is None:
+            results[i] = _error(404, "Пользователь с указанным номером не найден.")
+            return
+        telegram_id, notifications_enabled = user
+        if not notifications_enabled:
+            results[i] = _error(403, "Пользователь отключил получение заданий.")
+            return
+        message_text = build_task_message(base, *description)
+        async with semaphore:
+            try:
+                await send_and_save(telegram_id, message_text, ttk_number, month_day, loco_number)
+            except Exception as e:
+                results[i] = _error(502, f"{type(e).__name__}: {e}")
+                return
+        results[i] = {"status": 200, "detail": "Задание успешно отправлено."}
+
+    await asyncio.gather(*(deliver(i, *fields) for i, fields in parsed.items()))
+    return results